@@ -15,9 +15,14 @@ def create_app():
     from app.routes.inference import inference_bp
     from app.routes.dataset import dataset_bp
     from app.routes.finetune import finetune_bp
+    from app.routes.metrics import metrics_bp
+    from app.routes.predictions import predictions_bp
     app.register_blueprint(inference_bp, url_prefix='/api')
     app.register_blueprint(dataset_bp, url_prefix='/api')
     app.register_blueprint(finetune_bp, url_prefix='/api')
+    app.register_blueprint(predictions_bp, url_prefix='/api')
+    # Эндпоинт /metrics для Prometheus (не проксируется nginx наружу)
+    app.register_blueprint(metrics_bp)
 
     # Маршрут для корневого пути, отдающий index.html из папки website
     @app.route('/')
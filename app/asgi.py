@@ -0,0 +1,331 @@
+import time
+from contextlib import asynccontextmanager
+from io import BytesIO
+
+import pandas as pd
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import create_app
+from app.config import Config
+from app.services import metrics
+from app.routes.inference import (SENTIMENT_MAP, XLSX_MIMETYPE, results_to_sentiments, build_predictions_excel,
+                                  build_fanout_excel, fanout_columns, is_flag_set, parse_model_names,
+                                  validate_fanout_models, store_file_predictions, result_scores, validate_batch_model)
+from app.services.batch_stream import NDJSON_MIMETYPE, BatchStream, aiter_ndjson, is_ndjson, parse_json_array
+from app.services.admission import controller
+from app.services.model_selector import model_label
+from app.services.prediction_store import get_store
+from app.services.kafka_producer import send_task_and_await_response
+from app.services.scheduler import LANE_INTERACTIVE, LANE_BULK
+from app.services.transport import get_transport
+
+
+def _rejected(lane, timeout=30):
+    """Проверка допуска для асинхронных эндпоинтов (аналог admission_control)."""
+    status, retry_after = controller.try_admit(lane, timeout)
+    if status is None:
+        return None
+    return JSONResponse(
+        {"error": "Сервис перегружен, повторите запрос позже.", "retry_after": retry_after},
+        status_code=status,
+        headers={'Retry-After': str(retry_after)}
+    )
+
+
+def _excel_response(output):
+    return StreamingResponse(
+        output,
+        media_type=XLSX_MIMETYPE,
+        headers={'Content-Disposition': 'attachment; filename="result.xlsx"'}
+    )
+
+
+class _DuplexStreamingResponse(StreamingResponse):
+    """
+    Потоковый ответ, который отдаётся, пока ещё читается тело запроса (NDJSON /api/predict_batch).
+    StreamingResponse параллельно ждёт http.disconnect через receive() и забирал бы себе
+    куски тела запроса; здесь разрыв соединения замечает само чтение тела (ClientDisconnect).
+    on_close вызывается, когда ответ отдан или прерван, в том числе если поток так и не начался.
+    """
+
+    def __init__(self, content, on_close=None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+        if self.background is not None:
+            await self.background()
+
+
+def _wants_timings(request):
+    return Config.RESPONSE_TIMINGS or request.query_params.get('timings') == '1'
+
+
+async def _read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def _predict_text(request, task_type, default_letter):
+    data = await _read_json(request)
+    if not data or 'text' not in data:
+        return JSONResponse({"error": "Не предоставлен текст для анализа."}, status_code=400)
+
+    task = {'type': task_type, 'text': data['text']}
+    if task_type == 'predict_text':
+        task['model_name'] = data.get('model_name')
+        if is_flag_set(data.get('profile')):
+            task['profile'] = True
+    timings = metrics.StageTimings(
+        task_type=task_type,
+        model='ensemble' if task_type.endswith('_ensemble') else model_label(task.get('model_name'))
+    )
+
+    start_time = time.time()
+    try:
+        response = await send_task_and_await_response(
+            task,
+            request_topic='inference_request',
+            response_topic='inference_response',
+            timeout=30,
+            timings=timings
+        )
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    elapsed_time = time.time() - start_time
+
+    result = response.get('result')
+    if not result:
+        return JSONResponse({"error": "Ответ от воркера не содержит результата."}, status_code=500)
+
+    label = result.get("label", "").lower()
+    sentiment_letter = SENTIMENT_MAP.get(label, default_letter)
+    get_store().record([sentiment_letter], timings.labels['model'], [task['text']], scores=[result.get('score')],
+                       model_version=response.get('model_version'), source=task_type,
+                       request_id=response.get('correlation_id'))
+    payload = {
+        "result": sentiment_letter,
+        "inference_time": elapsed_time
+    }
+    if _wants_timings(request):
+        payload["timings"] = timings.as_dict()
+    if response.get('profile'):
+        payload["profile"] = response['profile']
+    return JSONResponse(payload)
+
+
+async def _predict_file(request, task_type):
+    form = await request.form()
+    upload = form.get('file')
+    if upload is None or isinstance(upload, str):
+        return JSONResponse({"error": "Не передан файл в поле 'file'."}, status_code=400)
+
+    model_name = form.get('model_name') if task_type == 'predict_file' else None
+    timings = metrics.StageTimings(
+        task_type=task_type, model='ensemble' if task_type.endswith('_ensemble') else model_label(model_name)
+    )
+
+    # Разбор Excel – работа для CPU, поэтому выполняется в пуле потоков, а не в цикле событий
+    content = await upload.read()
+    try:
+        with timings.stage('parse_request'):
+            df = await run_in_threadpool(pd.read_excel, BytesIO(content))
+    except Exception as e:
+        return JSONResponse({"error": f"Ошибка чтения Excel‑файла: {str(e)}"}, status_code=400)
+
+    text_column = form.get('text_column', "MessageText") if task_type == 'predict_file' else "MessageText"
+    if text_column not in df.columns:
+        return JSONResponse({"error": "В Excel‑файле должен присутствовать столбец 'MessageText'."},
+                            status_code=400)
+
+    task = {'type': task_type, 'texts': df[text_column].tolist()}
+    if task_type == 'predict_file':
+        task['model_name'] = model_name
+        if is_flag_set(form.get('profile')):
+            task['profile'] = True
+
+    start_time = time.time()
+    try:
+        response = await send_task_and_await_response(
+            task,
+            request_topic='inference_request',
+            response_topic='inference_response',
+            timeout=30,
+            timings=timings
+        )
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    elapsed_time = time.time() - start_time
+
+    results = response.get('results')
+    if not results:
+        return JSONResponse({"error": "Ответ от воркера не содержит результатов."}, status_code=500)
+
+    sentiments = results_to_sentiments(results)
+    store_file_predictions(df, text_column, sentiments, timings.labels['model'], response, task_type,
+                           scores=result_scores(results))
+    df['sentiment'] = sentiments
+    meta = {"inference_time": elapsed_time}
+    if _wants_timings(request):
+        meta.update({f"time_{stage}": seconds for stage, seconds in timings.as_dict().items()})
+    with timings.stage('build_response'):
+        output = await run_in_threadpool(build_predictions_excel, df, meta, response.get('profile'))
+    return _excel_response(output)
+
+
+async def _predict_file_fanout(request):
+    form = await request.form()
+    upload = form.get('file')
+    if upload is None or isinstance(upload, str):
+        return JSONResponse({"error": "Не передан файл в поле 'file'."}, status_code=400)
+
+    model_names = parse_model_names(form.getlist('model_names'))
+    include_ensemble = is_flag_set(form.get('include_ensemble'))
+    error = await run_in_threadpool(validate_fanout_models, model_names, include_ensemble)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+
+    timings = metrics.StageTimings(task_type='predict_file_fanout', model='fanout')
+    content = await upload.read()
+    try:
+        with timings.stage('parse_request'):
+            df = await run_in_threadpool(pd.read_excel, BytesIO(content))
+    except Exception as e:
+        return JSONResponse({"error": f"Ошибка чтения Excel‑файла: {str(e)}"}, status_code=400)
+
+    text_column = form.get('text_column', "MessageText")
+    if text_column not in df.columns:
+        return JSONResponse({"error": f"В Excel‑файле должен присутствовать столбец '{text_column}'."},
+                            status_code=400)
+
+    task = {
+        'type': 'predict_file_fanout',
+        'texts': df[text_column].tolist(),
+        'model_names': model_names,
+        'include_ensemble': include_ensemble
+    }
+
+    start_time = time.time()
+    try:
+        response = await send_task_and_await_response(
+            task,
+            request_topic='inference_request',
+            response_topic='inference_response',
+            timeout=30,
+            timings=timings
+        )
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    elapsed_time = time.time() - start_time
+
+    if not response.get('predictions'):
+        return JSONResponse({"error": response.get('error') or "Ответ от воркера не содержит результатов."},
+                            status_code=500)
+
+    for name in response['models']:
+        store_file_predictions(df, text_column, response['predictions'][name], name, response, 'predict_file_fanout',
+                               model_version=response.get('model_versions', {}).get(name),
+                               output_columns=fanout_columns(response))
+    meta = {"inference_time": elapsed_time}
+    if _wants_timings(request):
+        meta.update({f"time_{stage}": seconds for stage, seconds in timings.as_dict().items()})
+    with timings.stage('build_response'):
+        output = await run_in_threadpool(build_fanout_excel, df, response, meta)
+    return _excel_response(output)
+
+
+async def _predict_batch(request):
+    # Допуск – до чтения тела; место в пакетной полосе освобождается, когда поток ответа отдан (или прерван)
+    rejected = _rejected(LANE_BULK)
+    if rejected is not None:
+        return rejected
+
+    # До создания потокового ответа место освобождается здесь (ошибка запроса или исключение), после – им самим
+    streaming = False
+    try:
+        model_name = request.query_params.get('model_name') or None
+        ensemble = is_flag_set(request.query_params.get('ensemble'))
+        error = await run_in_threadpool(validate_batch_model, model_name, ensemble)
+        if is_ndjson(request.headers.get('content-type')):
+            records = aiter_ndjson(request.stream())
+        elif error is None:
+            try:
+                items = parse_json_array(await request.body())
+            except ValueError as e:
+                error = str(e)
+
+            async def iter_items():
+                for item in items:
+                    yield item
+            records = iter_items()
+        if error:
+            return JSONResponse({"error": error}, status_code=400)
+
+        response = _DuplexStreamingResponse(
+            BatchStream(model_name=model_name, ensemble=ensemble).astream(records),
+            on_close=lambda: controller.release(LANE_BULK), media_type=NDJSON_MIMETYPE
+        )
+        streaming = True
+        return response
+    finally:
+        if not streaming:
+            controller.release(LANE_BULK)
+
+
+def _admitted(lane, handler, *args):
+    """Оборачивает асинхронный обработчик проверкой допуска в полосу lane."""
+    async def endpoint(request):
+        rejected = _rejected(lane)
+        if rejected is not None:
+            return rejected
+        try:
+            return await handler(request, *args)
+        finally:
+            controller.release(lane)
+    return endpoint
+
+
+def create_asgi_app():
+    """
+    ASGI-приложение для режима SERVER_MODE='async' (uvicorn).
+
+    Эндпоинты инференса обрабатываются асинхронно: ожидание ответа воркера – это
+    await на Future транспорта, поэтому тысячи одновременных ожиданий не занимают потоков.
+    Остальные маршруты (подготовка датасета, модели, дообучение, статика) обслуживает
+    исходное Flask-приложение через WsgiToAsgi.
+    """
+    flask_app = create_app()
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # Потребители ответов запускаются до первого запроса
+        await run_in_threadpool(get_transport().prepare, ['inference_response', 'dataset_response'])
+        yield
+
+    routes = [
+        Route('/api/predict_text', _admitted(LANE_INTERACTIVE, _predict_text, 'predict_text', "N/A"),
+              methods=['POST']),
+        Route('/api/predict_text_ensemble',
+              _admitted(LANE_INTERACTIVE, _predict_text, 'predict_text_ensemble', "N"), methods=['POST']),
+        Route('/api/predict_file', _admitted(LANE_BULK, _predict_file, 'predict_file'), methods=['POST']),
+        Route('/api/predict_file_ensemble', _admitted(LANE_BULK, _predict_file, 'predict_file_ensemble'),
+              methods=['POST']),
+        Route('/api/predict_file_fanout', _admitted(LANE_BULK, _predict_file_fanout), methods=['POST']),
+        Route('/api/predict_batch', _predict_batch, methods=['POST']),
+        Mount('/', app=WsgiToAsgi(flask_app)),
+    ]
+    middleware = [Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])]
+    return Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
@@ -1,3 +1,6 @@
+import os
+
+
 class Config:
     DEBUG = True
     # Устройство: -1 для CPU, 0 или больше для GPU
@@ -5,13 +8,138 @@ class Config:
     KAFKA_BROKER_URL = 'kafka:9092'
     KAFKA_TOPIC_DATASET = 'dataset_preparation'
     KAFKA_TOPIC_FINETUNE = 'model_finetune'
+    # Группа потребителей воркеров (смещения коммитятся, воркеры делят партиции)
+    KAFKA_WORKER_GROUP = 'sentiment_worker'
+    # Сколько секунд серверный процесс ждёт назначения партиций reply-топика при запуске
+    KAFKA_REPLY_ASSIGN_TIMEOUT = 10
+
+    # Транспорт между Flask и воркером:
+    #   'kafka'  – через брокер (по умолчанию, несколько узлов),
+    #   'local'  – очереди multiprocessing на одном узле, без брокера,
+    #   'memory' – внутри одного процесса (тесты и бенчмарки).
+    TRANSPORT_BACKEND = os.environ.get('TRANSPORT_BACKEND', 'kafka')
+
+    # Режим HTTP-сервера: 'dev' – встроенный сервер Flask, 'async' – uvicorn (asyncio)
+    SERVER_MODE = os.environ.get('SERVER_MODE', 'dev')
+    # Число процессов uvicorn в режиме 'async' (только для транспорта 'kafka')
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', os.cpu_count() or 1))
+
+    # Формат сообщений: 'json' (по умолчанию) или 'msgpack' (бинарный, результаты в колонках).
+    # Топик ответов общий для всех серверов, и старые серверы читают каждое сообщение в нём как JSON,
+    # поэтому 'msgpack' включается только после обновления всех серверов и воркеров.
+    # Воркер отвечает в msgpack, только если msgpack включён и у него, и у отправителя задачи.
+    WIRE_FORMAT = os.environ.get('WIRE_FORMAT', 'json')
+    # Сжатие бинарных сообщений: None, 'zstd' или 'lz4' (если установлен соответствующий пакет)
+    WIRE_COMPRESSION = os.environ.get('WIRE_COMPRESSION', 'zstd') or None
+    # Сообщения меньше этого размера не сжимаются
+    WIRE_COMPRESSION_MIN_BYTES = 16 * 1024
+
+    # Сколько задач воркер держит в буфере с приоритетами (интерактивные раньше пакетных).
+    # Смещения Kafka фиксируются автоматически при чтении, поэтому при падении воркера задачи
+    # из буфера теряются, а большой буфер забирает задачи у свободных воркеров группы –
+    # буфер рассчитан на несколько задач, а не на очередь
+    WORKER_PREFETCH = int(os.environ.get('WORKER_PREFETCH', 8))
+
+    # Контроль допуска: максимум задач в ожидании ответа на процесс сервера по полосам
+    ADMISSION_MAX_INFLIGHT = {'interactive': 64, 'bulk': 4}
+    # Начальная оценка времени обработки одной задачи воркером (секунды) до первых ответов
+    ADMISSION_INITIAL_SERVICE_TIME = {'interactive': 0.3, 'bulk': 5.0}
+    # Коэффициент сглаживания скользящего среднего времени обработки
+    ADMISSION_EWMA_ALPHA = 0.2
+    # Сколько секунд глубина очереди, присланная воркером в ответе, считается актуальной
+    ADMISSION_QUEUE_DEPTH_TTL = 30
+
+    # Метрики: каждый процесс периодически сохраняет снимок своих метрик в эту папку
+    METRICS_DIR = os.environ.get('METRICS_DIR', './metrics')
+    METRICS_FLUSH_INTERVAL = 5
+    # Снимки, не обновлявшиеся дольше этого времени (секунды), считаются снимками завершённых
+    # процессов: в /metrics они не учитываются и удаляются (живые процессы сохраняют снимок
+    # каждые METRICS_FLUSH_INTERVAL секунд)
+    METRICS_SNAPSHOT_TTL = 60
+    # Границы корзин гистограмм длительностей (секунды)
+    METRICS_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+    # Возвращать времена этапов в ответах всегда (иначе – только с параметром запроса ?timings=1)
+    RESPONSE_TIMINGS = False
+
+    # Профилирование задач predict_text/predict_file с флагом 'profile' (cProfile и torch.profiler).
+    # Выключено по умолчанию; при включении профилируется доля PROFILING_SAMPLE_RATE помеченных задач.
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+    PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '1.0'))
+    # Профилировать также операторы torch (заметно замедляет профилируемую задачу)
+    PROFILING_TORCH = True
+    # Сколько функций и операторов попадает в сводку профиля в ответе
+    PROFILING_TOP_N = 15
+    # Папка для файлов профилей и сколько последних профилей в ней хранить
+    PROFILES_DIR = os.environ.get('PROFILES_DIR', './profiles')
+    PROFILES_KEEP = 50
+
+    # Хранилище предсказаний (SQLite): сырые строки и почасовые сводки для агрегатов /api/predictions/aggregate
+    PREDICTION_STORE_ENABLED = os.environ.get('PREDICTION_STORE_ENABLED', '1') == '1'
+    PREDICTION_STORE_PATH = os.environ.get('PREDICTION_STORE_PATH', './data/predictions.sqlite3')
+    # Сколько пакетов предсказаний может ждать записи (при переполнении новые отбрасываются)
+    PREDICTION_STORE_QUEUE_SIZE = 1000
+    # Столбцы файла, у которых за всё время набралось больше разных значений, в сводки по столбцам
+    # не попадают (а уже накопленные сводки по ним удаляются)
+    PREDICTION_STORE_MAX_COLUMN_VALUES = 1000
 
     # Имя модели по умолчанию (если чекпоинт не выбран) – либо название из Hugging Face,
     # либо путь к скачанной версии в папке MODEL_CACHE_DIR
     DEFAULT_MODEL_NAME = "blanchefort/rubert-base-cased-sentiment-rusentiment"
+    # Трансформер-часть ансамблевой модели
+    ENSEMBLE_TRANSFORMER_MODEL = "blanchefort/rubert-base-cased-sentiment-rusentiment"
 
     # Папка, куда будут скачиваться (кэшироваться) модели
     MODEL_CACHE_DIR = "./models"
 
+    # Потоки torch по умолчанию (до подбора автотюнером): внутри операторов и между операторами
+    TORCH_NUM_THREADS = int(os.environ.get('TORCH_NUM_THREADS', min(8, os.cpu_count() or 1)))
+    TORCH_INTEROP_THREADS = int(os.environ.get('TORCH_INTEROP_THREADS', min(8, os.cpu_count() or 1)))
+    # Размер пакета инференса файлов по умолчанию (до подбора автотюнером)
+    DEFAULT_BATCH_SIZE = 16
+    # Сколько загруженных моделей воркер держит в памяти
+    LOADED_MODELS_LIMIT = 2
+
+    # Fan-out запросы (один файл – несколько моделей): максимум моделей в запросе (вместе с ансамблем;
+    # самих моделей – не больше LOADED_MODELS_LIMIT, чтобы они не вытесняли друг друга из памяти)
+    # и общий бюджет потоков torch, который делится между моделями (None – число ядер)
+    FANOUT_MAX_MODELS = 4
+    FANOUT_THREAD_BUDGET = None
+
+    # Потоковый JSON/NDJSON-инференс /api/predict_batch: записи отправляются воркеру частями
+    # по BATCH_STREAM_CHUNK_SIZE, и на один запрос одновременно ждут ответа не больше
+    # BATCH_STREAM_WINDOW частей
+    BATCH_STREAM_CHUNK_SIZE = 256
+    BATCH_STREAM_WINDOW = 4
+
+    # Автотюнер: при первой загрузке модели на узле перебирает размер пакета и число потоков
+    # и выбирает максимальную пропускную способность при времени пакета не больше AUTOTUNE_LATENCY_SLO.
+    # Профили хранятся по модели и типу узла в AUTOTUNE_PROFILES_PATH и переподбираются
+    # не реже, чем раз в AUTOTUNE_MAX_AGE секунд.
+    AUTOTUNE_ENABLED = os.environ.get('AUTOTUNE_ENABLED', '1') == '1'
+    AUTOTUNE_BATCH_SIZES = [1, 4, 8, 16, 32, 64]
+    AUTOTUNE_LATENCY_SLO = 2.0
+    AUTOTUNE_ROUNDS = 3
+    # Длина пробных текстов в токенах
+    AUTOTUNE_PROBE_TOKENS = 128
+    AUTOTUNE_MAX_AGE = 30 * 24 * 3600
+    AUTOTUNE_PROFILES_PATH = os.path.join(MODEL_CACHE_DIR, "autotune.json")
+
     # Папка, где хранятся дообученные чекпоинты (локальные копии модели после обучения)
     CHECKPOINTS_DIR = "./checkpoints"
+
+    # Версионированные артефакты классической части ансамбля (HashingVectorizer + SGD и мета-модель).
+    # Внутри лежат папки v0001, v0002, ... и файл LATEST с именем актуальной версии.
+    CLASSIC_ARTIFACTS_DIR = os.path.join(MODEL_CACHE_DIR, "classic")
+    # Состояние инкрементального обучения: отпечатки строк датасета и кэш предсказаний трансформера
+    CLASSIC_TRAINER_STATE = os.path.join(CLASSIC_ARTIFACTS_DIR, "trainer_state.pkl")
+    # Переобучать классическую часть после каждой задачи prepare_dataset с размеченными строками
+    CLASSIC_AUTO_RETRAIN = True
+    # Сколько размеченных строк хранить в резервуаре для переобучения мета-модели
+    CLASSIC_META_SAMPLE_SIZE = 5000
+    # Сколько последних версий артефактов оставлять на диске
+    CLASSIC_KEEP_VERSIONS = 3
+    # Пока тренер не увидел столько размеченных строк, ансамбль использует исходные
+    # logistic.pkl/meta.pkl из MODEL_CACHE_DIR (модель, обученная на всём корпусе), а версии не публикуются
+    CLASSIC_MIN_TRAINED_ROWS = 1000
+    # Размер пакета трансформера при расчёте его предсказаний для новых строк датасета
+    CLASSIC_TRANSFORMER_BATCH_SIZE = 32
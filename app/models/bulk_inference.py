@@ -0,0 +1,202 @@
+import math
+import queue
+import threading
+
+import numpy as np
+import torch
+
+from app.services import metrics, profiling
+
+# Признак конца потока пакетов между этапами
+_DONE = object()
+
+
+def _stage_target(target):
+    """
+    Цель потока этапа. Если задача текущего потока профилируется, поток этапа
+    регистрируется в её профиле (profiling.ThreadProfiles) и выполняется под своим cProfile.
+    """
+    thread_profiles = profiling.current_thread_profiles()
+    return target if thread_profiles is None else thread_profiles.wrap(target)
+
+
+class _StageError:
+    """Исключение из фонового этапа, передаваемое по очереди следующему этапу."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _as_text(value):
+    """Пустые ячейки Excel (None/NaN) становятся пустой строкой, остальные значения – строкой."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return value if isinstance(value, str) else str(value)
+
+
+def softmax(logits):
+    """Построчный softmax для массива логитов [n, классы]."""
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class BulkInferenceEngine:
+    """
+    Пакетный инференс трансформера с перекрытием этапов.
+
+    Три этапа работают одновременно и связаны очередями ограниченной длины (двойная буферизация):
+      1. токенизация пакета быстрым токенизатором в фоновом потоке;
+      2. прямой проход модели в вызывающем потоке (torch.inference_mode);
+      3. векторизованная постобработка (softmax в NumPy) в фоновом потоке.
+    Пока модель считает пакет, следующий уже токенизируется, а предыдущий – обрабатывается.
+    Тексты группируются по длине, чтобы уменьшить паддинг; порядок результатов совпадает с входным.
+
+    Результат – массивы NumPy, а не словари на каждую строку.
+    """
+
+    def __init__(self, model, tokenizer, batch_size=16, max_length=512, queue_depth=2):
+        """
+        :param model: Модель AutoModelForSequenceClassification.
+        :param tokenizer: Быстрый токенизатор (PreTrainedTokenizerFast).
+        :param batch_size: Размер пакета прямого прохода.
+        :param max_length: Максимальная длина последовательности (длинные тексты обрезаются).
+        :param queue_depth: Сколько готовых пакетов может ждать в очереди между этапами.
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.queue_depth = queue_depth
+        self.id2label = model.config.id2label
+        self.label_names = np.array([self.id2label[i] for i in range(len(self.id2label))], dtype=object)
+
+    @staticmethod
+    def prepare_texts(texts):
+        """Приводит входные значения к строкам (см. _as_text)."""
+        return [_as_text(text) for text in texts]
+
+    @staticmethod
+    def batches(texts, batch_size):
+        """Индексы пакетов: тексты упорядочены по убыванию длины, чтобы в пакете были похожие длины."""
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+    def tokenize_into(self, texts, batches, queues, timings=None):
+        """
+        Этап токенизации: кодирует пакеты и кладёт каждый в каждую из очередей queues
+        (несколько очередей – когда один токенизатор общий для нескольких моделей).
+        В конце в очереди кладётся признак завершения, при ошибке – сама ошибка.
+        """
+        with metrics.activate(timings):
+            try:
+                for indices in batches:
+                    with metrics.stage('tokenize'):
+                        encoding = self.tokenizer(
+                            [texts[i] for i in indices],
+                            padding=True,
+                            truncation=True,
+                            max_length=self.max_length,
+                            return_tensors='pt',
+                        )
+                    for out_queue in queues:
+                        out_queue.put((indices, encoding))
+            except Exception as e:
+                for out_queue in queues:
+                    out_queue.put(_StageError(e))
+                return
+        for out_queue in queues:
+            out_queue.put(_DONE)
+
+    def _postprocess(self, in_queue, logits_out, probs_out, errors, timings):
+        with metrics.activate(timings):
+            while True:
+                item = in_queue.get()
+                if item is _DONE:
+                    return
+                indices, logits = item
+                try:
+                    with metrics.stage('postprocess'):
+                        logits_out[indices] = logits
+                        probs_out[indices] = softmax(logits)
+                except Exception as e:
+                    errors.append(e)
+
+    def predict_encoded(self, encoded, count):
+        """
+        Этапы прямого прохода и постобработки для пакетов из очереди encoded
+        (её заполняет tokenize_into). Очередь вычитывается до конца и при ошибке,
+        чтобы не блокировать этап токенизации.
+        :param count: Общее число текстов.
+        :return: Пара массивов float32 [count, число классов]: (логиты, вероятности).
+        """
+        num_labels = len(self.id2label)
+        logits_out = np.empty((count, num_labels), dtype=np.float32)
+        probs_out = np.empty((count, num_labels), dtype=np.float32)
+        timings = metrics.current_timings()
+        computed = queue.Queue(maxsize=self.queue_depth)
+        errors = []
+        postprocess_thread = threading.Thread(
+            target=_stage_target(self._postprocess), args=(computed, logits_out, probs_out, errors, timings),
+            daemon=True)
+        postprocess_thread.start()
+
+        device = self.model.device
+        finished = False
+        try:
+            with torch.inference_mode():
+                while True:
+                    item = encoded.get()
+                    if item is _DONE:
+                        finished = True
+                        break
+                    if isinstance(item, _StageError):
+                        finished = True
+                        raise item.error
+                    indices, encoding = item
+                    with metrics.stage('forward'):
+                        logits = self.model(**encoding.to(device)).logits
+                    computed.put((indices, logits.float().cpu().numpy()))
+        finally:
+            computed.put(_DONE)
+            postprocess_thread.join()
+            # Прямой проход завершился ошибкой – дочитываем очередь, чтобы этап токенизации завершился
+            while not finished:
+                item = encoded.get()
+                finished = item is _DONE or isinstance(item, _StageError)
+        if errors:
+            raise errors[0]
+        return logits_out, probs_out
+
+    def predict(self, texts, batch_size=None):
+        """
+        Вероятности классов для списка текстов.
+
+        :param texts: Список текстов.
+        :param batch_size: Размер пакета (по умолчанию – заданный при создании).
+        :return: Пара массивов float32 [n, число классов]: (логиты, вероятности);
+            столбцы соответствуют model.config.id2label.
+        """
+        texts = self.prepare_texts(texts)
+        encoded = queue.Queue(maxsize=self.queue_depth)
+        tokenizer_thread = threading.Thread(
+            target=_stage_target(self.tokenize_into),
+            args=(texts, self.batches(texts, batch_size or self.batch_size), [encoded], metrics.current_timings()),
+            daemon=True)
+        tokenizer_thread.start()
+        try:
+            return self.predict_encoded(encoded, len(texts))
+        finally:
+            # predict_encoded дочитывает очередь до конца, поэтому поток токенизации уже завершается
+            tokenizer_thread.join()
+
+    def labels(self, probs):
+        """Метки классов с максимальной вероятностью (массив строк)."""
+        return self.label_names[probs.argmax(axis=1)]
+
+    def to_results(self, probs):
+        """Переводит вероятности в список {'label', 'score'} (как у пайплайна Hugging Face)."""
+        best = probs.argmax(axis=1)
+        labels = self.label_names[best]
+        scores = probs[np.arange(len(probs)), best]
+        return [{'label': label, 'score': float(score)} for label, score in zip(labels, scores)]
@@ -8,31 +8,57 @@ from nltk.stem import SnowballStemmer
 import os
 import joblib
 from app.config import Config  # предполагается, что в конфиге задан MODEL_CACHE_DIR
+from app.models.sentiment_model import instrument_pipeline, model_version
+from app.services import metrics
 
 # Если стоп-слова ещё не скачаны
 nltk.download('stopwords')
-stop_words = set(stopwords.words('russian'))
+try:
+    stop_words = set(stopwords.words('russian'))
+except LookupError:
+    # Без доступа к сети (например, в офлайн-бенчмарке) корпус может быть не скачан
+    print("Стоп-слова NLTK недоступны, препроцессор работает без их удаления")
+    stop_words = set()
 stemmer = SnowballStemmer("russian")
 
+# Файл в CLASSIC_ARTIFACTS_DIR с именем актуальной версии артефактов классической части
+LATEST_FILE = "LATEST"
+
+
+def latest_version_dir(artifacts_dir=None):
+    """
+    Возвращает путь к актуальной версии артефактов классической части
+    (по файлу LATEST) или None, если ни одной версии ещё не опубликовано.
+    """
+    artifacts_dir = artifacts_dir or Config.CLASSIC_ARTIFACTS_DIR
+    latest_path = os.path.join(artifacts_dir, LATEST_FILE)
+    if not os.path.exists(latest_path):
+        return None
+    with open(latest_path, encoding='utf-8') as f:
+        version_name = f.read().strip()
+    version_dir = os.path.join(artifacts_dir, version_name)
+    return version_dir if os.path.isdir(version_dir) else None
+
 
 class EnsembleSentimentModel:
     def __init__(self, transformer_model_name=None, device=None):
         """
         Инициализация ансамблевой модели.
-        :param transformer_model_name: Имя или путь к трансформер-модели.
+        :param transformer_model_name: Имя или путь к трансформер-модели
+            (по умолчанию Config.ENSEMBLE_TRANSFORMER_MODEL).
         :param device: Устройство для выполнения (0 для GPU, -1 для CPU).
         """
-        self.transformer_model_name = transformer_model_name or "blanchefort/rubert-base-cased-sentiment-rusentiment"
+        self.transformer_model_name = transformer_model_name or Config.ENSEMBLE_TRANSFORMER_MODEL
         self.device = device if device is not None else (0 if torch.cuda.is_available() else -1)
 
         # Загружаем трансформер-пайплайн для анализа тональности
-        self.sentiment_analyzer = pipeline(
+        self.sentiment_analyzer = instrument_pipeline(pipeline(
             "sentiment-analysis",
             model=self.transformer_model_name,
             tokenizer=self.transformer_model_name,
             device=self.device,
             framework="pt"
-        )
+        ))
 
         # Инициализируем классическую модель (TF-IDF + LogisticRegression).
         # При обучении модель сохраняется в виде pickle-файлов.
@@ -41,6 +67,15 @@ class EnsembleSentimentModel:
         # Мета-модель (будет подгружена из кеша)
         self.meta_model = None
 
+        # Версия артефактов классической части ("legacy" для logistic.pkl/meta.pkl в MODEL_CACHE_DIR)
+        self.classic_version = None
+        self.transformer_version = model_version(self.transformer_model_name, self.sentiment_analyzer.model)
+
+    @property
+    def version(self):
+        """Версия ансамбля: версия трансформера и версия классической части."""
+        return f"{self.transformer_version}+{self.classic_version}"
+
     @staticmethod
     def clean_html_tags(text):
         """Удаляет HTML-теги из текста."""
@@ -97,6 +132,16 @@ class EnsembleSentimentModel:
         mapping = {"NEGATIVE": 2, "POSITIVE": 1, "NEUTRAL": 0}
         return mapping.get(label, -1)
 
+    def get_transformer_preds(self, texts, batch_size=32):
+        """
+        То же, что get_transformer_pred, для списка текстов: трансформер получает их пакетами.
+        Возвращает список числовых меток (2/1/0, -1 для неизвестных).
+        """
+        cleaned = [self.clean_html_tags(text) for text in texts]
+        results = self.sentiment_analyzer(cleaned, truncation=True, max_length=512, batch_size=batch_size)
+        mapping = {"NEGATIVE": 2, "POSITIVE": 1, "NEUTRAL": 0}
+        return [mapping.get(result['label'], -1) for result in results]
+
     def get_classic_pred(self, text):
         """
         Получает предсказание от классической модели (TF-IDF + LogisticRegression).
@@ -110,8 +155,10 @@ class EnsembleSentimentModel:
           - первое значение: предсказание трансформер-модели,
           - второе значение: предсказание классической модели.
         """
-        transformer_pred = self.get_transformer_pred(text)
-        classic_pred = self.get_classic_pred(text)
+        with metrics.stage('transformer'):
+            transformer_pred = self.get_transformer_pred(text)
+        with metrics.stage('classic'):
+            classic_pred = self.get_classic_pred(text)
         print(transformer_pred, classic_pred)
         return np.array([[transformer_pred, classic_pred]])
 
@@ -121,7 +168,8 @@ class EnsembleSentimentModel:
         Возвращает итоговую метку в виде буквы ("B", "G", "N").
         """
         meta_feat = self.get_meta_features(text)
-        pred_numeric = self.meta_model.predict(meta_feat)[0]
+        with metrics.stage('meta'):
+            pred_numeric = self.meta_model.predict(meta_feat)[0]
         mapping_back = {2: "B", 1: "G", 0: "N"}
         return mapping_back.get(pred_numeric, pred_numeric)
 
@@ -131,19 +179,59 @@ class EnsembleSentimentModel:
         Возвращает список итоговых меток (буквы: "B", "G", "N").
         """
         meta_features = np.concatenate([self.get_meta_features(text) for text in texts], axis=0)
-        preds_numeric = self.meta_model.predict(meta_features)
+        with metrics.stage('meta'):
+            preds_numeric = self.meta_model.predict(meta_features)
         mapping_back = {2: "B", 1: "G", 0: "N"}
         return [mapping_back.get(pred, pred) for pred in preds_numeric]
 
-    def load_cached_models(self):
+    def predict_batch_scores(self, texts):
+        """
+        То же, что predict_batch, но вместе с вероятностями мета-модели.
+        Возвращает пару (метки "B"/"G"/"N", список словарей {буква: вероятность}
+        или None, если мета-модель не умеет возвращать вероятности).
         """
-        Загружает предобученные модели для классической части и мета-модели
-        из указанной директории (MODEL_CACHE_DIR).
-        Ожидается, что классическая модель сохранена в 'logistic.pkl',
-        а мета-модель – в 'meta.pkl'.
+        meta_features = np.concatenate([self.get_meta_features(text) for text in texts], axis=0)
+        mapping_back = {2: "B", 1: "G", 0: "N"}
+        with metrics.stage('meta'):
+            preds_numeric = self.meta_model.predict(meta_features)
+            probs = self.meta_model.predict_proba(meta_features) if hasattr(self.meta_model, 'predict_proba') else None
+        labels = [mapping_back.get(pred, pred) for pred in preds_numeric]
+        if probs is None:
+            return labels, None
+        letters = [mapping_back.get(cls, str(cls)) for cls in self.meta_model.classes_]
+        return labels, [dict(zip(letters, row)) for row in probs.tolist()]
+
+    def predict_batch_with_transformer_preds(self, texts, transformer_preds):
+        """
+        То же, что predict_batch, когда предсказания трансформера (числовые метки 0/1/2)
+        уже получены, например той же моделью в fan-out запросе. Классическая часть
+        и мета-модель считаются сразу для всего списка.
+        """
+        with metrics.stage('classic'):
+            classic_preds = self.classic_pipeline.predict(list(texts))
+        meta_features = np.column_stack([transformer_preds, classic_preds])
+        with metrics.stage('meta'):
+            preds_numeric = self.meta_model.predict(meta_features)
+        mapping_back = {2: "B", 1: "G", 0: "N"}
+        return [mapping_back.get(pred, pred) for pred in preds_numeric]
+
+    def load_cached_models(self):
         """
-        classic_path = os.path.join(Config.MODEL_CACHE_DIR, "logistic.pkl")
-        meta_path = os.path.join(Config.MODEL_CACHE_DIR, "meta.pkl")
+        Загружает предобученные модели для классической части и мета-модели.
+        Если инкрементальный тренер уже опубликовал версию в CLASSIC_ARTIFACTS_DIR,
+        берётся актуальная версия (по файлу LATEST), иначе – исходные
+        'logistic.pkl' и 'meta.pkl' из MODEL_CACHE_DIR.
+        """
+        version_dir = latest_version_dir()
+        if version_dir is not None:
+            model_dir = version_dir
+            self.classic_version = os.path.basename(version_dir)
+        else:
+            model_dir = Config.MODEL_CACHE_DIR
+            self.classic_version = "legacy"
+
+        classic_path = os.path.join(model_dir, "logistic.pkl")
+        meta_path = os.path.join(model_dir, "meta.pkl")
 
         self.classic_pipeline = joblib.load(classic_path)
         self.meta_model = joblib.load(meta_path)
@@ -1,11 +1,52 @@
+import hashlib
 import os
+import time
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
 from app.config import Config
+from app.models.bulk_inference import BulkInferenceEngine
+from app.services import metrics
 
-# Настройка потоков для оптимизации на CPU
-torch.set_num_threads(8)
-torch.set_num_interop_threads(8)
+# Настройка потоков для оптимизации на CPU (для каждой модели уточняется автотюнером)
+torch.set_num_threads(Config.TORCH_NUM_THREADS)
+try:
+    torch.set_num_interop_threads(Config.TORCH_INTEROP_THREADS)
+except RuntimeError:
+    # Число межоператорных потоков задаётся один раз до начала параллельной работы
+    pass
+
+
+def instrument_pipeline(sentiment_pipeline):
+    """
+    Оборачивает этапы пайплайна Hugging Face замерами: preprocess (токенизация),
+    forward (прямой проход модели) и postprocess (softmax и метки).
+    Замеры попадают в метрики stage_duration_seconds и во времена текущего запроса.
+    """
+    for attr, stage_name in (('preprocess', 'tokenize'), ('forward', 'forward'), ('postprocess', 'postprocess')):
+        method = getattr(sentiment_pipeline, attr)
+
+        def timed(*args, _method=method, _stage=stage_name, **kwargs):
+            with metrics.stage(_stage):
+                return _method(*args, **kwargs)
+
+        setattr(sentiment_pipeline, attr, timed)
+    return sentiment_pipeline
+
+
+def model_version(model_path, model):
+    """
+    Версия модели для сохранённых предсказаний: ревизия с Hugging Face Hub (commit hash),
+    а для локальной папки – время последнего изменения файлов весов.
+    """
+    commit_hash = getattr(model.config, '_commit_hash', None)
+    if commit_hash:
+        return commit_hash[:12]
+    if os.path.isdir(model_path):
+        weights = [os.path.join(model_path, name) for name in os.listdir(model_path)
+                   if name.endswith(('.safetensors', '.bin'))]
+        if weights:
+            return time.strftime('%Y%m%d%H%M%S', time.gmtime(max(os.path.getmtime(path) for path in weights)))
+    return 'unknown'
 
 
 class SentimentModel:
@@ -26,13 +67,30 @@ class SentimentModel:
         self.model = AutoModelForSequenceClassification.from_pretrained(model_id, cache_dir=Config.MODEL_CACHE_DIR)
 
         # Создаем пайплайн – он использует уже загруженные модель и токенизатор
-        self.sentiment_analyzer = pipeline(
+        self.sentiment_analyzer = instrument_pipeline(pipeline(
             "sentiment-analysis",
             model=self.model,
             tokenizer=self.tokenizer,
             device=Config.DEVICE,
             framework="pt"
-        )
+        ))
+        # Пакетный инференс больших списков текстов с перекрытием токенизации и прямого прохода
+        self.bulk_engine = BulkInferenceEngine(self.model, self.tokenizer)
+        self._tokenizer_fingerprint = None
+        self.version = model_version(self.model_path, self.model)
+
+    def tokenizer_fingerprint(self):
+        """
+        Отпечаток токенизатора: у моделей с одинаковым отпечатком (например, чекпоинтов
+        одной базовой модели) тексты можно токенизировать один раз.
+        """
+        if self._tokenizer_fingerprint is None:
+            backend = getattr(self.tokenizer, 'backend_tokenizer', None)
+            description = backend.to_str() if backend is not None else repr(sorted(self.tokenizer.get_vocab().items()))
+            self._tokenizer_fingerprint = hashlib.sha1(
+                f"{type(self.tokenizer).__name__}:{self.tokenizer.model_max_length}:{description}".encode('utf-8')
+            ).hexdigest()
+        return self._tokenizer_fingerprint
 
     def predict(self, text, **pipeline_kwargs):
         """
@@ -47,3 +105,18 @@ class SentimentModel:
         Выполняет предсказание для списка текстов.
         """
         return self.sentiment_analyzer(texts, **pipeline_kwargs)
+
+    def predict_proba(self, texts, batch_size=16):
+        """
+        Вероятности классов для списка текстов в виде массива NumPy [n, число классов]
+        (столбцы соответствуют model.config.id2label). Используется BulkInferenceEngine.
+        """
+        _, probs = self.bulk_engine.predict(texts, batch_size=batch_size)
+        return probs
+
+    def predict_bulk(self, texts, batch_size=16):
+        """
+        То же, что predict_batch, но через BulkInferenceEngine: быстрее на больших файлах.
+        Возвращает список словарей {'label', 'score'}.
+        """
+        return self.bulk_engine.to_results(self.predict_proba(texts, batch_size=batch_size))
@@ -1,20 +1,162 @@
 import time
-from flask import Blueprint, request, send_file, jsonify
+from flask import Blueprint, Response, request, send_file, jsonify
 import pandas as pd
 from io import BytesIO
+from app.config import Config
+from app.services import metrics
 from app.services.kafka_producer import send_task_and_wait_for_response
-
-# Словарь для преобразования меток модели в требуемые символы
+from app.services.admission import admission_control, controller, rejection_response
+from app.services.batch_stream import NDJSON_MIMETYPE, BatchStream, is_ndjson, iter_ndjson, parse_json_array
+from app.services.model_selector import list_available_models, model_label
+from app.services.prediction_store import get_store
+from app.services.scheduler import LANE_INTERACTIVE, LANE_BULK
+
+# Словарь для преобразования меток модели в требуемые символы. Ансамбль сразу возвращает буквы –
+# они переводятся сами в себя, чтобы ответы и хранилище предсказаний использовали одни и те же метки
 SENTIMENT_MAP = {
     "negative": "B",  # negative -> B
     "positive": "G",  # positive -> G
-    "neutral": "N"    # neutral  -> N
+    "neutral": "N",   # neutral  -> N
+    "b": "B",
+    "g": "G",
+    "n": "N",
 }
 
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
 inference_bp = Blueprint('inference', __name__)
 
 
+def results_to_sentiments(results):
+    """Преобразует результаты воркера (словари с ключом "label") в буквы B/G/N (N/A для неизвестных)."""
+    return [SENTIMENT_MAP.get(res.get("label", "").lower(), "N/A") for res in results]
+
+
+def build_predictions_excel(df, meta, profile=None):
+    """
+    Записывает DataFrame с предсказаниями в Excel‑файл в памяти с двумя листами:
+    "Predictions" и "Meta" (meta – словарь {столбец: значение}).
+    Если передана сводка профиля воркера, добавляются листы "Profile",
+    "Profile functions" и "Profile operators".
+    """
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False, sheet_name='Predictions')
+        meta_df = pd.DataFrame({key: [value] for key, value in meta.items()})
+        meta_df.to_excel(writer, index=False, sheet_name='Meta')
+        if profile:
+            summary = {'profile': profile.get('name'), **profile.get('files', {})}
+            summary.update({f"share_{stage}": share for stage, share in profile.get('stage_shares', {}).items()})
+            pd.DataFrame([summary]).to_excel(writer, index=False, sheet_name='Profile')
+            pd.DataFrame(profile.get('top_functions', [])).to_excel(writer, index=False, sheet_name='Profile functions')
+            pd.DataFrame(profile.get('top_operators', [])).to_excel(writer, index=False, sheet_name='Profile operators')
+    output.seek(0)
+    return output
+
+
+def fanout_columns(response):
+    """Столбцы, которые fan-out ответ добавляет в файл: 'sentiment_<модель>' на каждую модель и 'agreement'."""
+    return [f"sentiment_{name}" for name in response['models']] + ['agreement']
+
+
+def build_fanout_excel(df, response, meta):
+    """
+    Excel‑файл с ответом fan-out задачи: на листе "Predictions" по столбцу 'sentiment_<модель>'
+    на каждую модель и столбец 'agreement' (доля моделей, согласных с большинством),
+    на листе "Agreement" – доля единогласных строк и попарное согласие моделей,
+    на листе "Distribution" – распределение меток каждой модели.
+    """
+    for name in response['models']:
+        df[f"sentiment_{name}"] = response['predictions'][name]
+    df['agreement'] = response['row_agreement']
+    agreement = response['agreement']
+
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False, sheet_name='Predictions')
+        pd.DataFrame({key: [value] for key, value in meta.items()}).to_excel(writer, index=False, sheet_name='Meta')
+        rows = [{'pair': 'all models (unanimous)', 'agreement': agreement['unanimous']}]
+        rows += [{'pair': pair, 'agreement': value} for pair, value in agreement['pairwise'].items()]
+        pd.DataFrame(rows).to_excel(writer, index=False, sheet_name='Agreement')
+        pd.DataFrame(agreement['distribution']).T.rename_axis('model').reset_index().to_excel(
+            writer, index=False, sheet_name='Distribution')
+    output.seek(0)
+    return output
+
+
+def parse_model_names(values):
+    """Список моделей fan-out запроса: несколько полей 'model_names' и/или имена через запятую."""
+    names = (name.strip() for value in values for name in value.split(','))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def validate_fanout_models(model_names, include_ensemble):
+    """
+    Проверяет список моделей fan-out запроса; возвращает текст ошибки или None.
+    Ансамбль считается в Config.FANOUT_MAX_MODELS наравне с моделями, а моделей не больше
+    Config.LOADED_MODELS_LIMIT: иначе воркер вытеснял бы и заново загружал веса на каждом запросе.
+    """
+    models_limit = min(Config.FANOUT_MAX_MODELS, Config.LOADED_MODELS_LIMIT)
+    if len(model_names or [None]) > models_limit:
+        return f"В одном запросе можно сравнить не больше {models_limit} моделей."
+    if len(model_names or [None]) + (1 if include_ensemble else 0) > Config.FANOUT_MAX_MODELS:
+        return f"В одном запросе можно сравнить не больше {Config.FANOUT_MAX_MODELS} моделей вместе с ансамблем."
+    available = list_available_models()
+    unknown = [name for name in model_names if name not in available]
+    if unknown:
+        return f"Модели недоступны: {unknown}. Доступны: {available}"
+    return None
+
+
+def is_flag_set(value):
+    """Выставлен ли флаг запроса: true в JSON или '1'/'true' в поле формы."""
+    return value is True or str(value).lower() in ('1', 'true')
+
+
+def store_file_predictions(df, text_column, sentiments, model, response, source, scores=None, model_version=None,
+                           output_columns=('sentiment',)):
+    """
+    Сохраняет предсказания по файлу в хранилище предсказаний; остальные столбцы файла
+    (кроме текста и столбцов output_columns, которые эндпоинт добавляет в ответ) сохраняются
+    для агрегатов по их значениям.
+    """
+    excluded = {text_column, *output_columns}
+    columns = {str(column): df[column].tolist() for column in df.columns if column not in excluded}
+    get_store().record(
+        sentiments, model, df[text_column].tolist(), scores=scores,
+        model_version=model_version or response.get('model_version'), source=source,
+        request_id=response.get('correlation_id'), columns=columns
+    )
+
+
+def result_scores(results):
+    """Уверенность модели по строкам (None для ансамбля, который её не возвращает)."""
+    return [res.get('score') for res in results]
+
+
+def wants_timings():
+    """Нужно ли вернуть времена этапов в ответе: Config.RESPONSE_TIMINGS или параметр ?timings=1."""
+    return Config.RESPONSE_TIMINGS or request.args.get('timings') == '1'
+
+
+def timings_meta(timings):
+    """Столбцы листа "Meta" с временами этапов (если они запрошены)."""
+    if not wants_timings():
+        return {}
+    return {f"time_{stage}": seconds for stage, seconds in timings.as_dict().items()}
+
+
+def excel_response(output):
+    return send_file(
+        output,
+        download_name="result.xlsx",
+        as_attachment=True,
+        mimetype=XLSX_MIMETYPE
+    )
+
+
 @inference_bp.route('/predict_text_ensemble', methods=['POST'])
+@admission_control(LANE_INTERACTIVE)
 def predict_text_ensemble():
     """
     Эндпоинт для предсказания по одному тексту с использованием ансамблевой модели.
@@ -31,6 +173,7 @@ def predict_text_ensemble():
         'type': 'predict_text_ensemble',
         'text': text,
     }
+    timings = metrics.StageTimings(task_type='predict_text_ensemble', model='ensemble')
 
     start_time = time.time()
     try:
@@ -38,7 +181,8 @@ def predict_text_ensemble():
             task,
             request_topic='inference_request',
             response_topic='inference_response',
-            timeout=30  # таймаут в секундах
+            timeout=30,  # таймаут в секундах
+            timings=timings
         )
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -50,13 +194,19 @@ def predict_text_ensemble():
 
     label = result.get("label", "").lower()
     sentiment_letter = SENTIMENT_MAP.get(label, "N")
-    return jsonify({
+    get_store().record([sentiment_letter], 'ensemble', [text], model_version=response.get('model_version'),
+                       source='predict_text_ensemble', request_id=response.get('correlation_id'))
+    payload = {
         "result": sentiment_letter,
         "inference_time": elapsed_time
-    })
+    }
+    if wants_timings():
+        payload["timings"] = timings.as_dict()
+    return jsonify(payload)
 
 
 @inference_bp.route('/predict_file_ensemble', methods=['POST'])
+@admission_control(LANE_BULK)
 def predict_file_ensemble():
     """
     Эндпоинт для предсказания по Excel‑файлу с использованием ансамблевой модели.
@@ -68,8 +218,10 @@ def predict_file_ensemble():
         return jsonify({"error": "Не передан файл в поле 'file'."}), 400
 
     file = request.files['file']
+    timings = metrics.StageTimings(task_type='predict_file_ensemble', model='ensemble')
     try:
-        df = pd.read_excel(file)
+        with timings.stage('parse_request'):
+            df = pd.read_excel(file)
     except Exception as e:
         return jsonify({"error": f"Ошибка чтения Excel‑файла: {str(e)}"}), 400
 
@@ -89,7 +241,8 @@ def predict_file_ensemble():
             task,
             request_topic='inference_request',
             response_topic='inference_response',
-            timeout=30
+            timeout=30,
+            timings=timings
         )
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -99,37 +252,25 @@ def predict_file_ensemble():
     if not results:
         return jsonify({"error": "Ответ от воркера не содержит результатов."}), 500
 
-    sentiments = []
     # Предполагаем, что каждый элемент результата – словарь с ключом "label"
-    for res in results:
-        label = res.get("label", "").lower()
-        sentiment_letter = SENTIMENT_MAP.get(label, "N/A")
-        sentiments.append(sentiment_letter)
-
+    sentiments = results_to_sentiments(results)
+    store_file_predictions(df, 'MessageText', sentiments, 'ensemble', response, 'predict_file_ensemble')
     df['sentiment'] = sentiments
 
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Predictions')
-        meta_df = pd.DataFrame({"inference_time": [elapsed_time]})
-        meta_df.to_excel(writer, index=False, sheet_name='Meta')
-    output.seek(0)
-
-    return send_file(
-        output,
-        download_name="result.xlsx",
-        as_attachment=True,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+    with timings.stage('build_response'):
+        output = build_predictions_excel(df, {"inference_time": elapsed_time, **timings_meta(timings)})
+    return excel_response(output)
 
 
 @inference_bp.route('/predict_text', methods=['POST'])
+@admission_control(LANE_INTERACTIVE)
 def predict_text():
     """
     Эндпоинт для предсказания по одному тексту.
     Ожидается JSON с полями:
       - text: текст для анализа
       - model_name (необязательно): имя модели, которая должна быть использована
+      - profile (необязательно): true – профилировать задачу в воркере (если включено в конфиге)
     Задача отправляется в Kafka (топик inference_request) с ожиданием ответа.
     """
     data = request.get_json()
@@ -145,6 +286,9 @@ def predict_text():
         'text': text,
         'model_name': model_name
     }
+    if is_flag_set(data.get('profile')):
+        task['profile'] = True
+    timings = metrics.StageTimings(task_type='predict_text', model=model_label(model_name))
 
     start_time = time.time()
     try:
@@ -152,7 +296,8 @@ def predict_text():
             task,
             request_topic='inference_request',
             response_topic='inference_response',
-            timeout=30  # таймаут в секундах
+            timeout=30,  # таймаут в секундах
+            timings=timings
         )
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -165,13 +310,22 @@ def predict_text():
 
     label = result.get("label", "").lower()
     sentiment_letter = SENTIMENT_MAP.get(label, "N/A")
-    return jsonify({
+    get_store().record([sentiment_letter], model_label(model_name), [text], scores=[result.get('score')],
+                       model_version=response.get('model_version'), source='predict_text',
+                       request_id=response.get('correlation_id'))
+    payload = {
         "result": sentiment_letter,
         "inference_time": elapsed_time  # время предсказания в секундах
-    })
+    }
+    if wants_timings():
+        payload["timings"] = timings.as_dict()
+    if response.get('profile'):
+        payload["profile"] = response['profile']
+    return jsonify(payload)
 
 
 @inference_bp.route('/predict_file', methods=['POST'])
+@admission_control(LANE_BULK)
 def predict_file():
     """
     Эндпоинт для предсказания по Excel‑файлу.
@@ -179,6 +333,7 @@ def predict_file():
     Ожидается multipart/form-data запрос с:
       - file: XLSX‑файл (ожидается наличие столбца 'MessageText')
       - model_name (необязательно): имя модели для инференса
+      - profile (необязательно): '1' – профилировать задачу в воркере (если включено в конфиге)
 
     Обработка:
       - Файл считывается с помощью pandas.read_excel.
@@ -195,9 +350,13 @@ def predict_file():
 
     file = request.files['file']
     text_column = request.form.get('text_column', "MessageText")
+    # Получаем имя модели из формы (если передано)
+    model_name = request.form.get('model_name')
+    timings = metrics.StageTimings(task_type='predict_file', model=model_label(model_name))
     try:
         # Читаем Excel‑файл в DataFrame
-        df = pd.read_excel(file)
+        with timings.stage('parse_request'):
+            df = pd.read_excel(file)
     except Exception as e:
         return jsonify({"error": f"Ошибка чтения Excel‑файла: {str(e)}"}), 400
 
@@ -207,15 +366,14 @@ def predict_file():
 
     texts = df[text_column].tolist()
 
-    # Получаем имя модели из формы (если передано)
-    model_name = request.form.get('model_name')
-
     # Формируем задачу для Kafka (тип 'predict_file')
     task = {
         'type': 'predict_file',
         'texts': texts,
         'model_name': model_name
     }
+    if is_flag_set(request.form.get('profile')):
+        task['profile'] = True
 
     start_time = time.time()
     try:
@@ -223,7 +381,8 @@ def predict_file():
             task,
             request_topic='inference_request',
             response_topic='inference_response',
-            timeout=30  # таймаут в секундах
+            timeout=30,  # таймаут в секундах
+            timings=timings
         )
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -234,42 +393,33 @@ def predict_file():
     if not results:
         return jsonify({"error": "Ответ от воркера не содержит результатов."}), 500
 
-    sentiments = []
-    for res in results:
-        label = res.get("label", "").lower()
-        sentiment_letter = SENTIMENT_MAP.get(label, "N/A")
-        sentiments.append(sentiment_letter)
-
     # Добавляем новый столбец с результатами в DataFrame
+    sentiments = results_to_sentiments(results)
+    store_file_predictions(df, text_column, sentiments, model_label(model_name), response, 'predict_file',
+                           scores=result_scores(results))
     df['sentiment'] = sentiments
 
     # Записываем DataFrame в Excel‑файл в памяти с дополнительным листом с информацией о времени предсказания
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Predictions')
-        # Лист с метаинформацией
-        meta_df = pd.DataFrame({"inference_time": [elapsed_time]})
-        meta_df.to_excel(writer, index=False, sheet_name='Meta')
-    output.seek(0)
-
-    # Возвращаем полученный файл как вложение
-    return send_file(
-        output,
-        download_name="result.xlsx",
-        as_attachment=True,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+    # и возвращаем полученный файл как вложение
+    with timings.stage('build_response'):
+        output = build_predictions_excel(df, {"inference_time": elapsed_time, **timings_meta(timings)},
+                                         profile=response.get('profile'))
+    return excel_response(output)
 
 @inference_bp.route('/predict_file_custom', methods=['POST'])
+@admission_control(LANE_BULK)
 def predict_file_custom():
     if 'file' not in request.files:
         return jsonify({"error": "Не передан файл в поле 'file'."}), 400
 
     file = request.files['file']
     text_column = request.form.get('text_column', "MessageText")
+    model_name = request.form.get('model_name')
+    timings = metrics.StageTimings(task_type='predict_file_custom', model=model_label(model_name))
 
     try:
-        df = pd.read_excel(file)
+        with timings.stage('parse_request'):
+            df = pd.read_excel(file)
     except Exception as e:
         return jsonify({"error": f"Ошибка чтения Excel‑файла: {str(e)}"}), 400
 
@@ -277,7 +427,6 @@ def predict_file_custom():
         return jsonify({"error": f"В Excel‑файле должен присутствовать столбец '{text_column}'."}), 400
 
     texts = df[text_column].tolist()
-    model_name = request.form.get('model_name')
 
     start_time = time.time()
     # Флаг, определяющий, какой метод предсказания использовался
@@ -285,10 +434,12 @@ def predict_file_custom():
     try:
         # Пытаемся использовать вашу модель
         from metamodels import predict as my_model_predict
-        predictions = my_model_predict(texts, verbose=False)
+        with timings.stage('local_inference'):
+            predictions = my_model_predict(texts, verbose=False)
         # Извлекаем сентимент для каждого текста
         sentiments = [pred.get('sentiment', 'error') for pred in predictions]
         method_used = 'my_model'
+        store_file_predictions(df, text_column, sentiments, 'metamodels', {}, 'predict_file_custom')
     except Exception as e:
         try:
             task = {
@@ -300,17 +451,16 @@ def predict_file_custom():
                 task,
                 request_topic='inference_request',
                 response_topic='inference_response',
-                timeout=30  # таймаут в секундах
+                timeout=30,  # таймаут в секундах
+                timings=timings
             )
             results = response.get('results')
             if not results:
                 return jsonify({"error": "Ответ от воркера не содержит результатов."}), 500
-            sentiments = []
-            for res in results:
-                label = res.get("label", "").lower()
-                sentiment_letter = SENTIMENT_MAP.get(label, "N/A")
-                sentiments.append(sentiment_letter)
+            sentiments = results_to_sentiments(results)
             method_used = 'fallback'
+            store_file_predictions(df, text_column, sentiments, model_label(model_name), response,
+                                   'predict_file_custom', scores=result_scores(results))
         except Exception as ex:
             return jsonify({"error": f"Ошибка при выполнении предсказаний (fallback): {str(ex)}"}), 500
 
@@ -320,19 +470,135 @@ def predict_file_custom():
     df['sentiment'] = sentiments
 
     # Формируем Excel‑файл с результатами и метаинформацией
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Predictions')
-        meta_df = pd.DataFrame({
-            "inference_time": [elapsed_time],
-            "method_used": [method_used]
+    with timings.stage('build_response'):
+        output = build_predictions_excel(df, {
+            "inference_time": elapsed_time,
+            "method_used": method_used,
+            **timings_meta(timings)
         })
-        meta_df.to_excel(writer, index=False, sheet_name='Meta')
-    output.seek(0)
+    return excel_response(output)
 
-    return send_file(
-        output,
-        download_name="result.xlsx",
-        as_attachment=True,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+
+@inference_bp.route('/predict_file_fanout', methods=['POST'])
+@admission_control(LANE_BULK)
+def predict_file_fanout():
+    """
+    Эндпоинт для сравнения нескольких моделей на одном Excel‑файле за один проход.
+
+    Ожидается multipart/form-data запрос с:
+      - file: XLSX‑файл (ожидается наличие столбца 'MessageText')
+      - model_names: имена моделей (несколько полей или через запятую; без них – модель по умолчанию)
+      - include_ensemble (необязательно): '1' – добавить ансамблевую модель
+      - text_column (необязательно): столбец с текстами
+
+    Файл читается и передаётся воркеру один раз (задача 'predict_file_fanout'); воркер
+    токенизирует тексты один раз на каждый токенизатор и запускает модели параллельно.
+    Ответ – Excel‑файл с предсказаниями всех моделей рядом и сводкой их согласия.
+    """
+    if 'file' not in request.files:
+        return jsonify({"error": "Не передан файл в поле 'file'."}), 400
+
+    file = request.files['file']
+    text_column = request.form.get('text_column', "MessageText")
+    model_names = parse_model_names(request.form.getlist('model_names'))
+    include_ensemble = is_flag_set(request.form.get('include_ensemble'))
+    error = validate_fanout_models(model_names, include_ensemble)
+    if error:
+        return jsonify({"error": error}), 400
+
+    timings = metrics.StageTimings(task_type='predict_file_fanout', model='fanout')
+    try:
+        with timings.stage('parse_request'):
+            df = pd.read_excel(file)
+    except Exception as e:
+        return jsonify({"error": f"Ошибка чтения Excel‑файла: {str(e)}"}), 400
+
+    if text_column not in df.columns:
+        return jsonify({"error": f"В Excel‑файле должен присутствовать столбец '{text_column}'."}), 400
+
+    task = {
+        'type': 'predict_file_fanout',
+        'texts': df[text_column].tolist(),
+        'model_names': model_names,
+        'include_ensemble': include_ensemble
+    }
+
+    start_time = time.time()
+    try:
+        response = send_task_and_wait_for_response(
+            task,
+            request_topic='inference_request',
+            response_topic='inference_response',
+            timeout=30,
+            timings=timings
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    elapsed_time = time.time() - start_time
+
+    if not response.get('predictions'):
+        return jsonify({"error": response.get('error') or "Ответ от воркера не содержит результатов."}), 500
+
+    for name in response['models']:
+        store_file_predictions(df, text_column, response['predictions'][name], name, response, 'predict_file_fanout',
+                               model_version=response.get('model_versions', {}).get(name),
+                               output_columns=fanout_columns(response))
+    with timings.stage('build_response'):
+        output = build_fanout_excel(df, response, {"inference_time": elapsed_time, **timings_meta(timings)})
+    return excel_response(output)
+
+
+def validate_batch_model(model_name, ensemble):
+    """Проверяет модель запроса /predict_batch; возвращает текст ошибки или None."""
+    if model_name and ensemble:
+        return "Укажите либо model_name, либо ensemble=1."
+    if model_name and model_name not in list_available_models():
+        return f"Модель недоступна: {model_name}. Доступны: {list_available_models()}"
+    return None
+
+
+@inference_bp.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """
+    Эндпоинт потокового инференса без Excel.
+
+    Тело запроса – JSON-массив [{"id": ..., "text": ...}, ...] или поток NDJSON
+    (Content-Type: application/x-ndjson) с такими же объектами по одному в строке.
+    Параметры запроса:
+      - model_name (необязательно): имя модели;
+      - ensemble (необязательно): '1' – ансамблевая модель.
+
+    Записи отправляются воркеру частями (задачи 'predict_batch') по мере чтения тела,
+    ответ – поток NDJSON {"id", "label", "scores"} (label – B/G/N, scores – вероятности
+    по буквам), строки отдаются по мере готовности частей (см. BatchStream).
+    """
+    # Допуск проверяется до чтения тела: отклонённый запрос не читает и не разбирает массив записей.
+    # Место в пакетной полосе занято, пока отдаётся поток, а не только до выхода из обработчика
+    status, retry_after = controller.try_admit(LANE_BULK, 30)
+    if status is not None:
+        return rejection_response(status, retry_after)
+
+    # До создания потокового ответа место освобождается здесь (ошибка запроса или исключение), после – им самим
+    streaming = False
+    try:
+        model_name = request.args.get('model_name') or None
+        ensemble = is_flag_set(request.args.get('ensemble'))
+        error = validate_batch_model(model_name, ensemble)
+        if is_ndjson(request.content_type):
+            records = iter_ndjson(request.stream)
+        elif error is None:
+            try:
+                records = parse_json_array(request.get_data())
+            except ValueError as e:
+                error = str(e)
+        if error:
+            return jsonify({"error": error}), 400
+
+        stream = BatchStream(model_name=model_name, ensemble=ensemble)
+        response = Response(stream.stream(records), mimetype=NDJSON_MIMETYPE)
+        response.call_on_close(lambda: controller.release(LANE_BULK))
+        streaming = True
+        return response
+    finally:
+        if not streaming:
+            controller.release(LANE_BULK)
@@ -0,0 +1,14 @@
+from flask import Blueprint, Response
+from app.services import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Метрики в текстовом формате Prometheus: гистограммы этапов (stage_duration_seconds
+    по stage, task_type и model), сериализации, счётчики задач воркера и индикаторы
+    размера пакета и глубины очередей. Собираются со всех процессов (сервер и воркер).
+    """
+    return Response(metrics.render_prometheus('server'), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,53 @@
+from datetime import datetime, timezone
+
+from flask import Blueprint, jsonify, request
+
+from app.services.prediction_store import WINDOWS, get_store
+
+predictions_bp = Blueprint('predictions', __name__)
+
+
+def parse_time(value):
+    """Время из параметра запроса: секунды epoch или дата/время ISO 8601 (без зоны – UTC)."""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+@predictions_bp.route('/predictions/aggregate', methods=['GET'])
+def aggregate_predictions():
+    """
+    Распределение меток сохранённых предсказаний по окнам времени, без обращения к моделям.
+    Параметры запроса:
+      - window: 'hour', 'day' (по умолчанию), 'week' или 'month' (UTC);
+      - from, to: границы интервала (ISO 8601 или секунды epoch), 'to' не включительно;
+      - model: только предсказания этой модели ('ensemble' – ансамбль);
+      - column: группировать по значению столбца исходного файла, иначе – по модели и её версии.
+    Ответ: {"window", "group_by", "rows": [{"bucket", "group", "counts": {"B", "G", "N"}, "total"}]}.
+    """
+    window = request.args.get('window', 'day')
+    if window not in WINDOWS:
+        return jsonify({"error": f"Неизвестное окно '{window}'. Доступны: {list(WINDOWS)}"}), 400
+    try:
+        start = parse_time(request.args.get('from'))
+        end = parse_time(request.args.get('to'))
+    except ValueError as e:
+        return jsonify({"error": f"Неверный формат времени: {e}"}), 400
+
+    column = request.args.get('column') or None
+    rows = get_store().aggregate(window=window, start=start, end=end,
+                                 model=request.args.get('model') or None, column=column)
+    return jsonify({"window": window, "group_by": column or "model", "rows": rows})
+
+
+@predictions_bp.route('/predictions/columns', methods=['GET'])
+def prediction_columns():
+    """Столбцы исходных файлов, по значениям которых доступны агрегаты (параметр column)."""
+    return jsonify(get_store().columns())
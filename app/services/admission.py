@@ -0,0 +1,134 @@
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import jsonify
+
+from app.config import Config
+from app.services import metrics
+from app.services.scheduler import LANE_INTERACTIVE, LANE_BULK, LANE_RANK
+
+
+class AdmissionController:
+    """
+    Контроль допуска запросов к инференсу.
+
+    Глубина очереди по каждой полосе (интерактивная / пакетная) – больше из двух значений:
+    число задач, отправленных этим процессом и ещё не получивших ответа, и глубина очереди
+    воркера из его последнего ответа ('queue_depth', актуальна Config.ADMISSION_QUEUE_DEPTH_TTL
+    секунд). Последняя включает задачи всех процессов сервера, поэтому процессы видят общую
+    нагрузку. Время обслуживания одной задачи оценивается скользящим средним по 'worker_time'
+    из ответов воркера; таймаут ожидания ответа учитывается как обслуживание длиной в таймаут,
+    так что перегрузка, при которой ответы не приходят вовсе, тоже поднимает оценку.
+    Запрос отклоняется сразу:
+      - 429, если в полосе уже Config.ADMISSION_MAX_INFLIGHT[полоса] задач;
+      - 503, если по оценке он всё равно не успеет до таймаута.
+    В обоих случаях возвращается заголовок Retry-After.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {lane: 0 for lane in LANE_RANK}
+        self._service_time = dict(Config.ADMISSION_INITIAL_SERVICE_TIME)
+        self._reported_depth = {}  # полоса -> (глубина очереди воркера, время ответа)
+
+    def estimated_wait(self, lane):
+        """
+        Оценка времени ожидания новой задачи в очереди воркера (в секундах).
+        Интерактивные задачи ждут только интерактивные и одну уже выполняющуюся
+        пакетную, пакетные – все задачи впереди.
+        """
+        with self._lock:
+            return self._estimated_wait(lane)
+
+    def _queue_depth(self, lane):
+        depth, reported_at = self._reported_depth.get(lane, (0, 0.0))
+        if time.time() - reported_at > Config.ADMISSION_QUEUE_DEPTH_TTL:
+            depth = 0
+        return max(self._inflight[lane], depth)
+
+    def _estimated_wait(self, lane):
+        interactive = self._queue_depth(LANE_INTERACTIVE) * self._service_time[LANE_INTERACTIVE]
+        if lane == LANE_INTERACTIVE:
+            return interactive + min(self._queue_depth(LANE_BULK), 1) * self._service_time[LANE_BULK]
+        return interactive + self._queue_depth(LANE_BULK) * self._service_time[LANE_BULK]
+
+    def try_admit(self, lane, timeout):
+        """
+        Пытается допустить запрос в полосу.
+        :return: (None, None) при допуске, иначе (HTTP-статус, Retry-After в секундах).
+        """
+        with self._lock:
+            if self._inflight[lane] >= Config.ADMISSION_MAX_INFLIGHT[lane]:
+                status, retry_after = 429, max(1, math.ceil(self._service_time[lane]))
+            else:
+                completion = self._estimated_wait(lane) + self._service_time[lane]
+                if completion > timeout:
+                    status, retry_after = 503, max(1, math.ceil(completion - timeout))
+                else:
+                    self._inflight[lane] += 1
+                    metrics.set_gauge('server_inflight', self._inflight[lane], lane=lane)
+                    return None, None
+        # Отклонённый запрос не доходит до ответа воркера, где метрики сохраняются обычно
+        metrics.inc('server_requests_rejected_total', lane=lane, status=status)
+        metrics.flush('server')
+        return status, retry_after
+
+    def release(self, lane):
+        with self._lock:
+            self._inflight[lane] -= 1
+            metrics.set_gauge('server_inflight', self._inflight[lane], lane=lane)
+
+    def observe(self, lane, service_time, queue_depth=None):
+        """
+        Обновляет оценку времени обслуживания задачи в полосе по ответу воркера
+        (или по таймауту – тогда service_time равно таймауту) и запоминает
+        глубину очереди воркера {полоса: число задач}, если она есть в ответе.
+        """
+        with self._lock:
+            if queue_depth:
+                now = time.time()
+                for depth_lane, depth in queue_depth.items():
+                    if depth_lane in LANE_RANK:
+                        self._reported_depth[depth_lane] = (depth, now)
+            if lane not in LANE_RANK or service_time is None:
+                return
+            alpha = Config.ADMISSION_EWMA_ALPHA
+            self._service_time[lane] = (1 - alpha) * self._service_time[lane] + alpha * service_time
+
+    def inflight(self):
+        with self._lock:
+            return dict(self._inflight)
+
+
+controller = AdmissionController()
+
+
+def rejection_response(status, retry_after):
+    """Ответ Flask на отклонённый запрос: 429/503 с заголовком Retry-After."""
+    response = jsonify({"error": "Сервис перегружен, повторите запрос позже.", "retry_after": retry_after})
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def admission_control(lane, timeout=30):
+    """
+    Декоратор эндпоинта инференса: проверяет допуск до чтения запроса и
+    освобождает место в полосе после ответа.
+    :param lane: Полоса приоритета ('interactive' или 'bulk').
+    :param timeout: Таймаут ожидания ответа воркера в эндпоинте (секунды).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            status, retry_after = controller.try_admit(lane, timeout)
+            if status is not None:
+                return rejection_response(status, retry_after)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                controller.release(lane)
+        return wrapper
+    return decorator
@@ -0,0 +1,241 @@
+import json
+import math
+import os
+import platform
+import threading
+import time
+
+import numpy as np
+import torch
+
+from app.config import Config
+
+# Фраза, из которой собираются пробные тексты нужной длины
+PROBE_SENTENCE = "Сервис в целом работает неплохо, но доставка опять задержалась на несколько дней."
+
+_lock = threading.Lock()
+# Сигнал о завершении подбора для тех, кто ждёт уже идущий подбор той же модели
+_tuning_done = threading.Condition(_lock)
+_profiles = {}
+# Модели, которые нужно подобрать, когда у воркера нет задач: (тип узла, модель) -> SentimentModel
+_pending = {}
+# Подборы, которые идут сейчас: (тип узла, модель)
+_tuning = set()
+
+
+def host_signature():
+    """
+    Тип узла: модель процессора, число ядер и версия torch. Профили сохраняются по типу
+    узла, а не по имени хоста, поэтому одинаковые узлы используют один и тот же профиль.
+    """
+    cpu_name = platform.processor() or platform.machine()
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu_name = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{cpu_name} x{os.cpu_count()} torch-{torch.__version__}"
+
+
+def thread_candidates():
+    """Число потоков для перебора: степени двойки до числа ядер и само число ядер."""
+    cpu_count = os.cpu_count() or 1
+    candidates = {cpu_count}
+    threads = 1
+    while threads < cpu_count:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+
+def default_profile():
+    """Профиль без подбора: значения из конфигурации."""
+    return {'batch_size': Config.DEFAULT_BATCH_SIZE, 'threads': Config.TORCH_NUM_THREADS, 'tuned': False}
+
+
+def _load_all():
+    if not os.path.exists(Config.AUTOTUNE_PROFILES_PATH):
+        return {}
+    try:
+        with open(Config.AUTOTUNE_PROFILES_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save(model_key, profile):
+    """Добавляет профиль модели в файл профилей (запись атомарная)."""
+    profiles = _load_all()
+    profiles.setdefault(host_signature(), {})[model_key] = profile
+    os.makedirs(os.path.dirname(Config.AUTOTUNE_PROFILES_PATH) or '.', exist_ok=True)
+    tmp_path = Config.AUTOTUNE_PROFILES_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(profiles, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, Config.AUTOTUNE_PROFILES_PATH)
+
+
+def _probe_texts(tokenizer, count):
+    """Пробные тексты длиной около Config.AUTOTUNE_PROBE_TOKENS токенов."""
+    sentence_tokens = max(1, len(tokenizer(PROBE_SENTENCE, add_special_tokens=False)['input_ids']))
+    text = " ".join([PROBE_SENTENCE] * math.ceil(Config.AUTOTUNE_PROBE_TOKENS / sentence_tokens))
+    return [text] * count
+
+
+def tune(model, interrupt=None):
+    """
+    Подбирает размер пакета и число потоков torch для модели на текущем узле.
+
+    Для каждого числа потоков из thread_candidates() и размера пакета из
+    Config.AUTOTUNE_BATCH_SIZES замеряется время прямого прохода пакета
+    (BulkInferenceEngine, Config.AUTOTUNE_ROUNDS замеров после прогрева).
+    Выбирается конфигурация с максимальной пропускной способностью, у которой
+    максимальное время пакета не превышает Config.AUTOTUNE_LATENCY_SLO; если таких нет –
+    самая быстрая по времени пакета. Большие пакеты после нарушения SLO не проверяются.
+
+    :param model: SentimentModel.
+    :param interrupt: Функция без аргументов; если она вернула True перед очередным замером,
+        подбор прерывается (у воркера появились задачи).
+    :return: Профиль {'batch_size', 'threads', 'throughput', 'batch_latency', ...}
+        или None, если подбор прерван.
+    """
+    engine = model.bulk_engine
+    probe = _probe_texts(model.tokenizer, max(Config.AUTOTUNE_BATCH_SIZES))
+    previous_threads = torch.get_num_threads()
+    started_at = time.time()
+    candidates = []
+    try:
+        for threads in thread_candidates():
+            torch.set_num_threads(threads)
+            for batch_size in sorted(Config.AUTOTUNE_BATCH_SIZES):
+                if interrupt is not None and interrupt():
+                    return None
+                texts = probe[:batch_size]
+                engine.predict(texts, batch_size=batch_size)  # прогрев
+                latencies = []
+                for _ in range(Config.AUTOTUNE_ROUNDS):
+                    round_started_at = time.perf_counter()
+                    engine.predict(texts, batch_size=batch_size)
+                    latencies.append(time.perf_counter() - round_started_at)
+                latency = max(latencies)
+                candidates.append({
+                    'batch_size': batch_size,
+                    'threads': threads,
+                    'throughput': batch_size / float(np.mean(latencies)),
+                    'batch_latency': latency,
+                })
+                if latency > Config.AUTOTUNE_LATENCY_SLO:
+                    break
+    finally:
+        torch.set_num_threads(previous_threads)
+
+    within_slo = [c for c in candidates if c['batch_latency'] <= Config.AUTOTUNE_LATENCY_SLO]
+    if within_slo:
+        best = max(within_slo, key=lambda c: c['throughput'])
+    else:
+        best = min(candidates, key=lambda c: c['batch_latency'])
+    return {
+        **best,
+        'tuned': True,
+        'latency_slo': Config.AUTOTUNE_LATENCY_SLO,
+        'probe_tokens': Config.AUTOTUNE_PROBE_TOKENS,
+        'tuned_at': time.time(),
+        'tuning_time': time.time() - started_at,
+    }
+
+
+def _is_fresh(profile):
+    return profile is not None and time.time() - profile.get('tuned_at', 0) <= Config.AUTOTUNE_MAX_AGE
+
+
+def _tuning_key(model):
+    return host_signature(), model.model_path
+
+
+def _tune_and_save(model, key, interrupt=None):
+    model_key = model.model_path
+    try:
+        print(f"Подбор размера пакета и числа потоков для модели {model_key}...")
+        profile = tune(model, interrupt)
+        if profile is None:
+            print(f"Подбор для модели {model_key} прерван: у воркера есть задачи")
+            with _lock:
+                _pending[key] = model
+            return
+        _save(model_key, profile)
+        with _lock:
+            _profiles[model_key] = profile
+        print(f"Модель {model_key}: batch_size={profile['batch_size']}, threads={profile['threads']}, "
+              f"{profile['throughput']:.1f} текст/с (подбор занял {profile['tuning_time']:.1f} с)")
+    except Exception as e:
+        print(f"Ошибка подбора параметров инференса для модели {model_key}: {e}")
+    finally:
+        with _lock:
+            _tuning.discard(key)
+            _tuning_done.notify_all()
+
+
+def get_profile(model, wait=False):
+    """
+    Профиль (размер пакета и число потоков) для модели на этом узле.
+
+    Профиль берётся из памяти процесса, затем из Config.AUTOTUNE_PROFILES_PATH, если он
+    не старше Config.AUTOTUNE_MAX_AGE. Иначе модель подбирается заново: при wait=True –
+    сразу (запуск воркера; если подбор этой модели уже идёт, вызов дожидается его),
+    при wait=False – модель ставится в очередь tune_pending, а пока возвращается
+    устаревший профиль или значения из конфигурации, чтобы подбор не задерживал задачи.
+    При выключенном Config.AUTOTUNE_ENABLED возвращаются значения из конфигурации.
+    """
+    if not Config.AUTOTUNE_ENABLED:
+        return default_profile()
+    model_key = model.model_path
+    with _lock:
+        profile = _profiles.get(model_key)
+        if _is_fresh(profile):
+            return profile
+        saved = _load_all().get(host_signature(), {}).get(model_key)
+        if saved is not None:
+            profile = _profiles[model_key] = saved
+        if _is_fresh(profile):
+            return profile
+        key = _tuning_key(model)
+        if not wait:
+            if key not in _tuning:
+                _pending[key] = model
+            return profile or default_profile()
+        while key in _tuning:
+            _tuning_done.wait()
+        profile = _profiles.get(model_key)
+        if _is_fresh(profile):
+            return profile
+        _pending.pop(key, None)
+        _tuning.add(key)
+    _tune_and_save(model, key)
+    with _lock:
+        return _profiles.get(model_key) or default_profile()
+
+
+def tune_pending(interrupt=None):
+    """
+    Подбирает профиль одной модели из очереди get_profile. Воркер вызывает её, когда у него
+    нет задач, поэтому замеры не конкурируют с инференсом за ядра. Если во время подбора
+    пришла задача (interrupt() вернула True), подбор прерывается, и модель остаётся в очереди
+    до следующего простоя.
+    :return: True, если подбор выполнялся, False – очередь пуста.
+    """
+    with _lock:
+        key = next((key for key in _pending if key not in _tuning), None)
+        if key is None:
+            return False
+        model = _pending.pop(key)
+        _tuning.add(key)
+    _tune_and_save(model, key, interrupt)
+    return True
+
+
+def apply_threads(profile):
+    """Устанавливает число потоков torch из профиля (настройка процесса, дешёвая при повторе)."""
+    if torch.get_num_threads() != profile['threads']:
+        torch.set_num_threads(profile['threads'])
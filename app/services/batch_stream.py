@@ -0,0 +1,265 @@
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from starlette.concurrency import run_in_threadpool
+
+from app.config import Config
+from app.services import metrics
+from app.services.kafka_producer import record_response, record_timeout
+from app.services.model_selector import model_label
+from app.services.prediction_store import get_store
+from app.services.transport import get_transport
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Типы содержимого, при которых тело запроса читается построчно как NDJSON
+NDJSON_CONTENT_TYPES = {'application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/x-jsonlines'}
+
+# Метки моделей (NEGATIVE/POSITIVE/NEUTRAL) и ансамбля (B/G/N) -> буквы ответа
+LETTERS = {"negative": "B", "positive": "G", "neutral": "N", "b": "B", "g": "G", "n": "N"}
+
+
+def to_letter(label):
+    return LETTERS.get(str(label).lower(), "N/A")
+
+
+def is_ndjson(content_type):
+    """Передан ли поток NDJSON (иначе тело – JSON-массив записей)."""
+    return (content_type or '').split(';')[0].strip().lower() in NDJSON_CONTENT_TYPES
+
+
+def parse_record(item, position):
+    """
+    Запись запроса: объект с полями 'text' и (необязательно) 'id'.
+    Без 'id' идентификатором становится номер записи (с нуля).
+    :return: Пара (id, текст).
+    """
+    if not isinstance(item, dict) or 'text' not in item:
+        raise ValueError(f"Запись {position}: ожидается объект с полем 'text'.")
+    return item.get('id', position), item['text']
+
+
+def parse_json_array(body):
+    """Записи из тела запроса с JSON-массивом [{"id", "text"}, ...]."""
+    try:
+        items = json.loads(body)
+    except ValueError as e:
+        raise ValueError(f"Неверный JSON: {e}")
+    if not isinstance(items, list):
+        raise ValueError("Ожидается JSON-массив записей или поток NDJSON.")
+    return [parse_record(item, position) for position, item in enumerate(items)]
+
+
+class InvalidRecord:
+    """Неверная строка потока NDJSON: стоит на месте текста записи, в ответе ей соответствует строка с ошибкой."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _parse_line(line, position):
+    """Пара (id, текст) строки NDJSON; для неверной строки – (номер строки, InvalidRecord)."""
+    try:
+        item = json.loads(line)
+    except ValueError as e:
+        return position, InvalidRecord(f"Запись {position}: неверный JSON ({e})")
+    try:
+        return parse_record(item, position)
+    except ValueError as e:
+        return position, InvalidRecord(str(e))
+
+
+def iter_ndjson(lines):
+    """
+    Записи потока NDJSON (по одному JSON-объекту в строке, пустые строки пропускаются).
+    Неверная строка не прерывает чтение: она отдаётся как (номер строки, InvalidRecord).
+    """
+    position = 0
+    for line in lines:
+        if line.strip():
+            yield _parse_line(line, position)
+            position += 1
+
+
+async def aiter_ndjson(chunks):
+    """Асинхронный вариант iter_ndjson для тела запроса, приходящего произвольными кусками байтов."""
+    position = 0
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield _parse_line(line, position)
+                position += 1
+    if buffer.strip():
+        yield _parse_line(buffer, position)
+
+
+def _line(payload):
+    return json.dumps(payload, ensure_ascii=False) + '\n'
+
+
+class BatchStream:
+    """
+    Потоковый инференс записей {id, text} без Excel.
+
+    Записи группируются в части по Config.BATCH_STREAM_CHUNK_SIZE; каждая часть отправляется
+    воркеру отдельной задачей 'predict_batch', как только набрана, – не дожидаясь конца
+    тела запроса. Одновременно ответа ждут не больше Config.BATCH_STREAM_WINDOW частей:
+    следующая часть читается и отправляется, когда готова самая старая. Результаты
+    отдаются строками NDJSON {"id", "label", "scores"} в порядке записей, а ошибки части
+    или неверные строки потока – строками {"id", "error"} на их месте: статус HTTP к этому
+    моменту уже отправлен.
+    """
+
+    def __init__(self, model_name=None, ensemble=False, timeout=30):
+        """
+        :param model_name: Имя модели (None – модель по умолчанию).
+        :param ensemble: True – предсказания ансамблевой модели.
+        :param timeout: Сколько секунд ждать ответа на одну часть.
+        """
+        self.model_name = model_name
+        self.ensemble = ensemble
+        self.timeout = timeout
+        self.model = 'ensemble' if ensemble else model_label(model_name)
+        self.timings = metrics.StageTimings(task_type='predict_batch', model=self.model)
+
+    def _submit(self, chunk):
+        """Отправляет воркеру верные записи части (если в части только неверные строки – ничего)."""
+        task = {
+            'type': 'predict_batch',
+            'texts': [text for _, text in chunk if not isinstance(text, InvalidRecord)],
+            'model_name': self.model_name,
+            'ensemble': self.ensemble,
+        }
+        future = None
+        if task['texts']:
+            future = get_transport().submit(task, 'inference_request', 'inference_response', timeout=self.timeout)
+            metrics.inc('server_batch_stream_chunks_total', model=self.model)
+        return chunk, task, future, time.perf_counter()
+
+    def _results(self, pending, response):
+        """Результаты {"id", ...} для отправленных воркеру записей части (response None – таймаут)."""
+        chunk, task, _, started_at = pending
+        record_ids = [record_id for record_id, text in chunk if not isinstance(text, InvalidRecord)]
+        if not record_ids:
+            return []
+        if response is None:
+            record_timeout(task, self.timeout)
+            return [{'id': record_id, 'error': "Timeout waiting for worker response"} for record_id in record_ids]
+        record_response(task, response, time.perf_counter() - started_at, self.timings)
+        labels = response.get('labels')
+        if response.get('error') or labels is None:
+            error = response.get('error') or "Ответ от воркера не содержит результатов."
+            return [{'id': record_id, 'error': error} for record_id in record_ids]
+
+        labels = [to_letter(label) for label in labels]
+        scores = [
+            {to_letter(label): score for label, score in row.items()} if row else None
+            for row in (response.get('scores') or [None] * len(labels))
+        ]
+        get_store().record(
+            labels, self.model, task['texts'], scores=[max(row.values()) if row else None for row in scores],
+            model_version=response.get('model_version'), source='predict_batch',
+            request_id=response.get('correlation_id')
+        )
+        results = [
+            {'id': record_id, 'label': label, 'scores': row}
+            for record_id, label, row in zip(record_ids, labels, scores)
+        ]
+        # Ответ воркера короче части – записям без результата отдаётся ошибка, а поток не обрывается
+        results += [
+            {'id': record_id, 'error': "Ответ от воркера не содержит результата для записи."}
+            for record_id in record_ids[len(results):]
+        ]
+        return results
+
+    def _lines(self, pending, response):
+        """Строки NDJSON части в порядке записей: результаты воркера и ошибки неверных строк."""
+        results = iter(self._results(pending, response))
+        return [
+            _line({'id': record_id, 'error': text.error} if isinstance(text, InvalidRecord) else next(results))
+            for record_id, text in pending[0]
+        ]
+
+    def _remaining(self, pending):
+        return max(0.0, self.timeout - (time.perf_counter() - pending[3]))
+
+    def _wait(self, pending):
+        if pending[2] is None:
+            return self._lines(pending, None)
+        try:
+            response = pending[2].result(timeout=self._remaining(pending))
+        except FutureTimeoutError:
+            get_transport().discard(pending[1])
+            response = None
+        return self._lines(pending, response)
+
+    async def _await(self, pending):
+        if pending[2] is None:
+            return await run_in_threadpool(self._lines, pending, None)
+        try:
+            response = await asyncio.wait_for(asyncio.wrap_future(pending[2]), self._remaining(pending))
+        except asyncio.TimeoutError:
+            get_transport().discard(pending[1])
+            response = None
+        # Разбор ответа пишет в хранилище предсказаний – тоже вне цикла событий
+        return await run_in_threadpool(self._lines, pending, response)
+
+    def _discard(self, in_flight):
+        # Клиент ушёл – ответы на оставшиеся части больше не нужны
+        for pending in in_flight:
+            if pending[2] is not None:
+                get_transport().discard(pending[1])
+
+    def stream(self, records):
+        """
+        Генератор строк NDJSON с результатами.
+        :param records: Итерируемые пары (id, текст), например iter_ndjson(request.stream).
+        """
+        chunk_size = Config.BATCH_STREAM_CHUNK_SIZE
+        in_flight = deque()
+        chunk = []
+        try:
+            for record in records:
+                chunk.append(record)
+                if len(chunk) == chunk_size:
+                    in_flight.append(self._submit(chunk))
+                    chunk = []
+                    if len(in_flight) >= Config.BATCH_STREAM_WINDOW:
+                        yield from self._wait(in_flight.popleft())
+            if chunk:
+                in_flight.append(self._submit(chunk))
+            while in_flight:
+                yield from self._wait(in_flight.popleft())
+        finally:
+            self._discard(in_flight)
+
+    async def astream(self, records):
+        """
+        Асинхронный вариант stream: ожидание ответов – await на Future транспорта, а отправка
+        части (блокирующая запись в транспорт) – в пуле потоков, не в цикле событий.
+        :param records: Асинхронный итератор пар (id, текст), например aiter_ndjson(request.stream()).
+        """
+        chunk_size = Config.BATCH_STREAM_CHUNK_SIZE
+        in_flight = deque()
+        chunk = []
+        try:
+            async for record in records:
+                chunk.append(record)
+                if len(chunk) == chunk_size:
+                    in_flight.append(await run_in_threadpool(self._submit, chunk))
+                    chunk = []
+                    if len(in_flight) >= Config.BATCH_STREAM_WINDOW:
+                        for line in await self._await(in_flight.popleft()):
+                            yield line
+            if chunk:
+                in_flight.append(await run_in_threadpool(self._submit, chunk))
+            while in_flight:
+                for line in await self._await(in_flight.popleft()):
+                    yield line
+        finally:
+            self._discard(in_flight)
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import random
+import shutil
+import time
+
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.pipeline import Pipeline
+
+from app.config import Config
+from app.models.ensemble_sentiment_model import EnsembleSentimentModel, LATEST_FILE, latest_version_dir
+
+# Числовые метки классической части ансамбля: 2 – негатив, 1 – позитив, 0 – нейтрально
+LABEL_CODES = {
+    "B": 2, "NEGATIVE": 2,
+    "G": 1, "POSITIVE": 1,
+    "N": 0, "NEUTRAL": 0,
+}
+CLASSES = np.array([0, 1, 2])
+
+
+def normalize_label(value):
+    """
+    Приводит метку из датасета к числу 0/1/2.
+    Поддерживаются буквы B/G/N, названия NEGATIVE/POSITIVE/NEUTRAL и сами числа.
+    Для нераспознанных значений возвращает None.
+    """
+    if isinstance(value, str):
+        return LABEL_CODES.get(value.strip().upper())
+    try:
+        code = int(value)
+    except (TypeError, ValueError):
+        return None
+    return code if code in (0, 1, 2) else None
+
+
+def text_fingerprint(text):
+    """Отпечаток текста строки – по нему определяется, встречалась ли строка раньше."""
+    return hashlib.sha1(text.strip().encode('utf-8')).hexdigest()
+
+
+class IncrementalClassicTrainer:
+    """
+    Инкрементальное переобучение классической части ансамбля.
+
+    Каждая строка датасета получает отпечаток по тексту. Линейная модель
+    (HashingVectorizer + SGDClassifier) дообучается через partial_fit только на новых
+    строках и строках, у которых изменилась метка, поэтому стоимость переобучения
+    пропорциональна размеру изменения, а не размеру корпуса. Мета-модель переобучается
+    на ограниченном резервуаре строк (CLASSIC_META_SAMPLE_SIZE) с закэшированными
+    предсказаниями трансформера.
+
+    Результат публикуется как новая версия в CLASSIC_ARTIFACTS_DIR (logistic.pkl, meta.pkl),
+    после чего файл LATEST переключается на неё – EnsembleSentimentModel.load_cached_models
+    подхватывает новую версию при следующей загрузке.
+
+    Пока тренер не увидел CLASSIC_MIN_TRAINED_ROWS строк, а исходные logistic.pkl/meta.pkl
+    (обученные на всём корпусе) есть в MODEL_CACHE_DIR, версии не публикуются: состояние
+    только накапливается, и ансамбль продолжает использовать исходную модель.
+
+    Удалённые из датасета строки не «разучиваются»: SGD не поддерживает обратных шагов.
+    """
+
+    def __init__(self, transformer_predict=None, artifacts_dir=None, state_path=None, transformer_predict_batch=None):
+        """
+        :param transformer_predict: Функция text -> числовая метка трансформера (0/1/2).
+        :param artifacts_dir: Папка с версиями артефактов.
+        :param state_path: Путь к файлу состояния обучения.
+        :param transformer_predict_batch: Функция [text] -> [числовая метка] (пакетный вариант).
+            Если не задана ни одна из функций, используется EnsembleSentimentModel.get_transformer_preds.
+        """
+        self.artifacts_dir = artifacts_dir or Config.CLASSIC_ARTIFACTS_DIR
+        self.state_path = state_path or Config.CLASSIC_TRAINER_STATE
+        self._transformer_predict = transformer_predict
+        self._transformer_predict_batch = transformer_predict_batch
+        self.state = self._load_state()
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            return joblib.load(self.state_path)
+        return {
+            'version': 0,
+            'labels': {},             # отпечаток -> числовая метка
+            'transformer_preds': {},  # отпечаток -> предсказание трансформера
+            'reservoir': [],          # [(отпечаток, текст)] для переобучения мета-модели
+            'seen': 0,                # сколько уникальных строк прошло через резервуар
+            'vectorizer': HashingVectorizer(
+                preprocessor=EnsembleSentimentModel.custom_preprocessor,
+                ngram_range=(1, 2),
+                n_features=2 ** 20,
+                alternate_sign=False,
+            ),
+            'classifier': SGDClassifier(loss='log_loss', alpha=1e-5, random_state=0),
+        }
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        joblib.dump(self.state, tmp_path)
+        os.replace(tmp_path, self.state_path)
+
+    def _transformer_preds(self, texts):
+        if self._transformer_predict_batch is None:
+            if self._transformer_predict is not None:
+                return [self._transformer_predict(text) for text in texts]
+            self._transformer_predict_batch = EnsembleSentimentModel().get_transformer_preds
+        preds = []
+        batch_size = Config.CLASSIC_TRANSFORMER_BATCH_SIZE
+        for start in range(0, len(texts), batch_size):
+            preds.extend(self._transformer_predict_batch(texts[start:start + batch_size]))
+        return preds
+
+    def _ready_to_publish(self):
+        """Можно ли публиковать версию вместо исходной модели, обученной на всём корпусе."""
+        if latest_version_dir(self.artifacts_dir) is not None:
+            return True
+        if not os.path.exists(os.path.join(Config.MODEL_CACHE_DIR, "logistic.pkl")):
+            return True
+        return len(self.state['labels']) >= Config.CLASSIC_MIN_TRAINED_ROWS
+
+    def diff(self, records, text_key='TextAnalyze', label_key='Sentiment'):
+        """
+        Сравнивает размеченные записи с состоянием и возвращает только новые
+        и изменённые строки в виде списка (отпечаток, текст, метка).
+        Дубликаты внутри одного датасета учитываются один раз (последняя метка побеждает).
+        """
+        delta = {}
+        for record in records:
+            text = record.get(text_key)
+            label = normalize_label(record.get(label_key))
+            if not isinstance(text, str) or not text.strip() or label is None:
+                continue
+            fingerprint = text_fingerprint(text)
+            if self.state['labels'].get(fingerprint) != label:
+                delta[fingerprint] = (fingerprint, text, label)
+            else:
+                delta.pop(fingerprint, None)
+        return list(delta.values())
+
+    def _update_reservoir(self, delta):
+        """Обновляет резервуар строк для мета-модели (reservoir sampling, алгоритм R)."""
+        reservoir = self.state['reservoir']
+        positions = {fingerprint: i for i, (fingerprint, _) in enumerate(reservoir)}
+        limit = Config.CLASSIC_META_SAMPLE_SIZE
+        for fingerprint, text, _ in delta:
+            if fingerprint in positions:
+                continue
+            if fingerprint in self.state['labels']:
+                # Строка уже проходила через резервуар, изменилась только метка
+                continue
+            self.state['seen'] += 1
+            if len(reservoir) < limit:
+                positions[fingerprint] = len(reservoir)
+                reservoir.append((fingerprint, text))
+            else:
+                j = random.randrange(self.state['seen'])
+                if j < limit:
+                    del positions[reservoir[j][0]]
+                    positions[fingerprint] = j
+                    reservoir[j] = (fingerprint, text)
+
+    def _fit_meta(self, classic_pipeline, delta):
+        """Переобучает мета-модель на резервуаре и текущем изменении."""
+        rows = {fingerprint: text for fingerprint, text in self.state['reservoir']}
+        rows.update({fingerprint: text for fingerprint, text, _ in delta})
+        fingerprints = list(rows)
+        texts = [rows[fingerprint] for fingerprint in fingerprints]
+
+        classic_preds = classic_pipeline.predict(texts)
+        transformer_preds = [self.state['transformer_preds'][fingerprint] for fingerprint in fingerprints]
+        features = np.column_stack([transformer_preds, classic_preds])
+        targets = np.array([self.state['labels'][fingerprint] for fingerprint in fingerprints])
+
+        if len(set(targets)) < 2:
+            previous_dir = latest_version_dir(self.artifacts_dir)
+            if previous_dir is None:
+                raise ValueError("Для обучения мета-модели нужно минимум два класса в данных.")
+            return joblib.load(os.path.join(previous_dir, "meta.pkl"))
+
+        meta_model = LogisticRegression(max_iter=1000)
+        meta_model.fit(features, targets)
+        return meta_model
+
+    def _publish(self, classic_pipeline, meta_model, delta_size):
+        """Записывает новую версию артефактов и атомарно переключает LATEST на неё."""
+        version = self.state['version'] + 1
+        version_name = f"v{version:04d}"
+        version_dir = os.path.join(self.artifacts_dir, version_name)
+        os.makedirs(version_dir, exist_ok=True)
+
+        joblib.dump(classic_pipeline, os.path.join(version_dir, "logistic.pkl"))
+        joblib.dump(meta_model, os.path.join(version_dir, "meta.pkl"))
+        with open(os.path.join(version_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': version_name,
+                'created_at': time.time(),
+                'rows_total': len(self.state['labels']),
+                'rows_delta': delta_size,
+            }, f, ensure_ascii=False)
+
+        tmp_path = os.path.join(self.artifacts_dir, LATEST_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(version_name)
+        os.replace(tmp_path, os.path.join(self.artifacts_dir, LATEST_FILE))
+
+        self.state['version'] = version
+        self._prune_versions()
+        return version_name
+
+    def _prune_versions(self):
+        versions = sorted(
+            name for name in os.listdir(self.artifacts_dir)
+            if name.startswith('v') and os.path.isdir(os.path.join(self.artifacts_dir, name))
+        )
+        for name in versions[:-Config.CLASSIC_KEEP_VERSIONS]:
+            shutil.rmtree(os.path.join(self.artifacts_dir, name), ignore_errors=True)
+
+    def update(self, records, text_key='TextAnalyze', label_key='Sentiment'):
+        """
+        Дообучает классическую часть на изменениях датасета и публикует новую версию.
+
+        :param records: Список словарей (строки подготовленного датасета).
+        :return: Имя опубликованной версии или None, если изменений нет или строк
+            пока недостаточно для публикации (см. CLASSIC_MIN_TRAINED_ROWS).
+        """
+        delta = self.diff(records, text_key=text_key, label_key=label_key)
+        if not delta:
+            return None
+
+        try:
+            missing = [(fingerprint, text) for fingerprint, text, _ in delta
+                       if fingerprint not in self.state['transformer_preds']]
+            preds = self._transformer_preds([text for _, text in missing])
+            for (fingerprint, _), pred in zip(missing, preds):
+                self.state['transformer_preds'][fingerprint] = pred
+
+            vectorizer = self.state['vectorizer']
+            classifier = self.state['classifier']
+            features = vectorizer.transform([text for _, text, _ in delta])
+            classifier.partial_fit(features, np.array([label for _, _, label in delta]), classes=CLASSES)
+
+            self._update_reservoir(delta)
+            for fingerprint, _, label in delta:
+                self.state['labels'][fingerprint] = label
+
+            if not self._ready_to_publish():
+                self._save_state()
+                return None
+
+            classic_pipeline = Pipeline([('vectorizer', vectorizer), ('classifier', classifier)])
+            meta_model = self._fit_meta(classic_pipeline, delta)
+            version_name = self._publish(classic_pipeline, meta_model, len(delta))
+            self._save_state()
+        except Exception:
+            # Состояние в памяти возвращается к сохранённому: иначе строки неудачного обновления
+            # считались бы уже обученными и не попали бы в следующее
+            self.state = self._load_state()
+            raise
+        return version_name
@@ -0,0 +1,185 @@
+import json
+import time
+
+import numpy as np
+from app.config import Config
+from app.services import metrics
+
+try:
+    import msgpack
+except ImportError:  # без msgpack остаётся только JSON
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Заголовок бинарного сообщения: MAGIC + версия формата + код сжатия.
+# Старые сообщения – обычный JSON (начинается с '{'), поэтому их легко отличить.
+MAGIC = b'SA'
+WIRE_VERSION = 1
+COMPRESSION_CODES = {None: 0, 'zstd': 1, 'lz4': 2}
+COMPRESSION_NAMES = {code: name for name, code in COMPRESSION_CODES.items()}
+
+# Ключ, под которым передаются результаты в колоночном виде
+COLUMNAR_KEY = 'results_columnar'
+
+
+def supported_features():
+    """
+    Возможности этого процесса для согласования формата ответа:
+    список добавляется в задачу ('wire_accept'), и воркер отвечает тем, что понимает отправитель.
+    """
+    features = []
+    if msgpack is not None:
+        features.append('msgpack')
+        if zstandard is not None:
+            features.append('zstd')
+        if lz4_frame is not None:
+            features.append('lz4')
+    return features
+
+
+def accepted_features():
+    """
+    Форматы ответа, которые отправитель задачи готов принять ('wire_accept').
+    Бинарные ответы запрашиваются, только когда msgpack включён в Config.WIRE_FORMAT:
+    ответы идут в общий топик, который могут читать серверы, понимающие только JSON.
+    """
+    return supported_features() if Config.WIRE_FORMAT == 'msgpack' else []
+
+
+def reply_options(task):
+    """
+    Выбирает формат ответа на задачу. Задачи от старых отправителей не содержат
+    'wire_accept' и получают ответ в JSON; JSON используется и тогда, когда msgpack
+    не включён в Config.WIRE_FORMAT самого воркера.
+    :return: Пара (формат, сжатие).
+    """
+    accepted = task.get('wire_accept') or []
+    if Config.WIRE_FORMAT != 'msgpack' or 'msgpack' not in accepted or msgpack is None:
+        return 'json', None
+    compression = Config.WIRE_COMPRESSION
+    if compression not in accepted or compression not in supported_features():
+        compression = None
+    return 'msgpack', compression
+
+
+def _to_columnar(results):
+    """
+    Переводит список результатов [{'label': ..., 'score': ...}] в колонки:
+    словарь меток, массив кодов меток и массив оценок (float32).
+    Возвращает None, если результаты имеют другую структуру.
+    """
+    if not isinstance(results, list) or not results:
+        return None
+    keys = set(results[0])
+    if keys not in ({'label', 'score'}, {'label'}):
+        return None
+    labels = []
+    label_index = {}
+    codes = np.empty(len(results), dtype='<u2')
+    scores = np.empty(len(results), dtype='<f4') if 'score' in keys else None
+    for i, item in enumerate(results):
+        if not isinstance(item, dict) or set(item) != keys or not isinstance(item['label'], str):
+            return None
+        label = item['label']
+        if label not in label_index:
+            label_index[label] = len(labels)
+            labels.append(label)
+        codes[i] = label_index[label]
+        if scores is not None:
+            scores[i] = item['score']
+    return {
+        'labels': labels,
+        'codes': codes.tobytes(),
+        'scores': scores.tobytes() if scores is not None else None,
+    }
+
+
+def _from_columnar(columns):
+    labels = columns['labels']
+    codes = np.frombuffer(columns['codes'], dtype='<u2')
+    if columns.get('scores') is None:
+        return [{'label': labels[code]} for code in codes]
+    scores = np.frombuffer(columns['scores'], dtype='<f4')
+    return [{'label': labels[code], 'score': float(score)} for code, score in zip(codes, scores)]
+
+
+def _compress(payload, compression):
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(payload)
+    if compression == 'lz4':
+        return lz4_frame.compress(payload)
+    return payload
+
+
+def _decompress(payload, compression):
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if compression == 'lz4':
+        return lz4_frame.decompress(payload)
+    return payload
+
+
+def encode(message, wire_format=None, compression=None):
+    """
+    Сериализует задачу или ответ.
+
+    :param wire_format: 'json' (старый формат) или 'msgpack'; по умолчанию Config.WIRE_FORMAT.
+    :param compression: None, 'zstd' или 'lz4' (только для msgpack). Сообщения меньше
+        Config.WIRE_COMPRESSION_MIN_BYTES не сжимаются.
+    """
+    started_at = time.perf_counter()
+    data = _encode(message, wire_format, compression)
+    metrics.observe('codec_seconds', time.perf_counter() - started_at, op='encode')
+    metrics.inc('message_bytes_total', len(data), op='encode')
+    return data
+
+
+def decode(data):
+    """Десериализует сообщение в любом из поддерживаемых форматов (JSON или бинарном)."""
+    started_at = time.perf_counter()
+    message = _decode(data)
+    metrics.observe('codec_seconds', time.perf_counter() - started_at, op='decode')
+    return message
+
+
+def _encode(message, wire_format=None, compression=None):
+    wire_format = wire_format or Config.WIRE_FORMAT
+    if wire_format != 'msgpack' or msgpack is None:
+        return json.dumps(message).encode('utf-8')
+
+    columns = _to_columnar(message.get('results'))
+    if columns is not None:
+        message = {key: value for key, value in message.items() if key != 'results'}
+        message[COLUMNAR_KEY] = columns
+    payload = msgpack.packb(message, use_bin_type=True)
+
+    if compression not in supported_features() or len(payload) < Config.WIRE_COMPRESSION_MIN_BYTES:
+        compression = None
+    payload = _compress(payload, compression)
+    return MAGIC + bytes([WIRE_VERSION, COMPRESSION_CODES[compression]]) + payload
+
+
+def _decode(data):
+    if not data.startswith(MAGIC):
+        return json.loads(data.decode('utf-8'))
+
+    version, compression_code = data[2], data[3]
+    if version != WIRE_VERSION:
+        raise ValueError(f"Неподдерживаемая версия формата сообщения: {version}")
+    if msgpack is None:
+        raise ValueError("Получено бинарное сообщение, но msgpack не установлен")
+    payload = _decompress(data[4:], COMPRESSION_NAMES[compression_code])
+    message = msgpack.unpackb(payload, raw=False)
+    columns = message.pop(COLUMNAR_KEY, None)
+    if columns is not None:
+        message['results'] = _from_columnar(columns)
+    return message
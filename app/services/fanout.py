@@ -0,0 +1,155 @@
+import itertools
+import os
+import queue
+import threading
+
+import numpy as np
+import torch
+
+from app.config import Config
+from app.models.bulk_inference import BulkInferenceEngine
+from app.services import autotuner, metrics
+from app.services.classic_trainer import normalize_label
+
+ENSEMBLE_NAME = 'ensemble'
+# Числовые метки (как в классической части ансамбля) -> буквы ответа
+LETTERS = {2: "B", 1: "G", 0: "N"}
+
+
+def _codes(labels):
+    """Метки моделей (NEGATIVE/POSITIVE/NEUTRAL или B/G/N) -> числа 0/1/2, -1 для нераспознанных."""
+    codes = [normalize_label(label) for label in labels]
+    return np.array([-1 if code is None else code for code in codes], dtype=np.int8)
+
+
+def agreement_summary(codes_by_model):
+    """
+    Сводка согласия моделей.
+
+    :param codes_by_model: {имя модели: массив числовых меток}.
+    :return: Пара (сводка, доля моделей, согласных с большинством, для каждой строки).
+        Сводка: доля строк с единогласным ответом, попарная доля совпадений
+        и распределение меток каждой модели.
+    """
+    names = list(codes_by_model)
+    matrix = np.stack([codes_by_model[name] for name in names])
+    counts = np.stack([(matrix == code).sum(axis=0) for code in LETTERS])
+    row_agreement = counts.max(axis=0) / len(names)
+    summary = {
+        'unanimous': float((row_agreement == 1).mean()) if matrix.shape[1] else 1.0,
+        'pairwise': {
+            f"{a} vs {b}": float((codes_by_model[a] == codes_by_model[b]).mean()) if matrix.shape[1] else 1.0
+            for a, b in itertools.combinations(names, 2)
+        },
+        'distribution': {
+            name: {LETTERS[code]: int((codes_by_model[name] == code).sum()) for code in LETTERS}
+            for name in names
+        },
+    }
+    return summary, row_agreement
+
+
+def run_fanout(texts, models, ensemble=None, thread_budget=None):
+    """
+    Прогоняет один список текстов через несколько моделей.
+
+    Модели группируются по отпечатку токенизатора: в каждой группе тексты токенизируются
+    один раз, и каждый пакет передаётся во все модели группы. Модели работают одновременно
+    в своих потоках, бюджет потоков torch делится между ними поровну. Если трансформер
+    ансамбля есть среди моделей, ансамбль использует его предсказания, а не считает их заново.
+
+    :param texts: Список текстов.
+    :param models: {имя: SentimentModel}.
+    :param ensemble: EnsembleSentimentModel или None.
+    :param thread_budget: Общее число потоков torch (по умолчанию Config.FANOUT_THREAD_BUDGET или число ядер).
+    :return: Словарь с ключами 'models', 'predictions' ({имя: буквы B/G/N}),
+        'agreement' (см. agreement_summary) и 'row_agreement'.
+    """
+    texts = BulkInferenceEngine.prepare_texts(texts)
+    timings = metrics.current_timings()
+    budget = thread_budget or Config.FANOUT_THREAD_BUDGET or os.cpu_count() or 1
+    workers = len(models) + (1 if ensemble is not None else 0)
+    threads_per_worker = max(1, budget // max(1, workers))
+
+    groups = {}
+    for name, model in models.items():
+        groups.setdefault(model.tokenizer_fingerprint(), []).append(name)
+
+    probs_by_model = {}
+    errors = []
+    threads = []
+
+    def run_model(name, encoded):
+        torch.set_num_threads(threads_per_worker)
+        with metrics.activate(timings):
+            try:
+                _, probs_by_model[name] = models[name].bulk_engine.predict_encoded(encoded, len(texts))
+            except Exception as e:
+                errors.append(e)
+
+    for names in groups.values():
+        engine = models[names[0]].bulk_engine
+        batch_size = min(autotuner.get_profile(models[name])['batch_size'] for name in names)
+        queues = [queue.Queue(maxsize=engine.queue_depth) for _ in names]
+        threads.append(threading.Thread(
+            target=engine.tokenize_into,
+            args=(texts, engine.batches(texts, batch_size), queues, timings),
+            daemon=True))
+        for name, encoded in zip(names, queues):
+            threads.append(threading.Thread(target=run_model, args=(name, encoded), daemon=True))
+
+    # Трансформер ансамбля среди моделей запроса: его предсказания переиспользуются.
+    # Ансамбль подаёт трансформеру тексты без HTML-тегов, поэтому это возможно, только если тегов нет.
+    shared_transformer = None
+    if ensemble is not None:
+        for name, model in models.items():
+            if model.model_path == ensemble.transformer_model_name:
+                shared_transformer = name
+                break
+        if shared_transformer is not None and any(ensemble.clean_html_tags(text) != text for text in texts):
+            shared_transformer = None
+
+    ensemble_labels = []
+
+    def run_ensemble():
+        torch.set_num_threads(threads_per_worker)
+        with metrics.activate(timings):
+            try:
+                ensemble_labels.extend(ensemble.predict_batch(texts))
+            except Exception as e:
+                errors.append(e)
+
+    if ensemble is not None and shared_transformer is None:
+        threads.append(threading.Thread(target=run_ensemble, daemon=True))
+
+    previous_threads = torch.get_num_threads()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        torch.set_num_threads(previous_threads)
+    if errors:
+        raise errors[0]
+
+    predictions = {}
+    codes_by_model = {}
+    for name in models:
+        codes = _codes(models[name].bulk_engine.labels(probs_by_model[name]))
+        codes_by_model[name] = codes
+        predictions[name] = [LETTERS.get(code, "N/A") for code in codes.tolist()]
+
+    if ensemble is not None:
+        if shared_transformer is not None:
+            ensemble_labels = ensemble.predict_batch_with_transformer_preds(texts, codes_by_model[shared_transformer])
+        codes_by_model[ENSEMBLE_NAME] = _codes(ensemble_labels)
+        predictions[ENSEMBLE_NAME] = list(ensemble_labels)
+
+    summary, row_agreement = agreement_summary(codes_by_model)
+    return {
+        'models': list(predictions),
+        'predictions': predictions,
+        'agreement': summary,
+        'row_agreement': row_agreement.astype(float).round(4).tolist(),
+    }
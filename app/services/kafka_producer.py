@@ -1,48 +1,72 @@
-import uuid
-import json
-from kafka import KafkaProducer, KafkaConsumer
-from app.config import Config
+import asyncio
+import time
 
+from app.services.transport import get_transport
+from app.services.admission import controller
+from app.services import metrics
 
-def send_task_and_wait_for_response(task, request_topic, response_topic, timeout=30):
+
+def record_response(task, response, roundtrip, timings):
+    """
+    Учитывает ответ воркера: уточняет оценку очереди для контроля допуска и
+    раскладывает время запроса на этапы – транспорт целиком, ожидание в очереди
+    (транспорт минус работа воркера) и этапы воркера с префиксом 'worker.'.
+    """
+    controller.observe(task.get('priority'), response.get('worker_time'), response.get('queue_depth'))
+    if timings is None:
+        timings = metrics.StageTimings(task_type=task.get('type'))
+    timings.add('transport', roundtrip)
+    worker_time = response.get('worker_time')
+    if worker_time is not None:
+        timings.add('queue_wait', max(0.0, roundtrip - worker_time))
+    timings.merge(response.get('timings'), prefix='worker.')
+    metrics.flush('server')
+
+
+def record_timeout(task, timeout):
+    """Учитывает таймаут ожидания ответа: для контроля допуска задача обслуживалась весь таймаут."""
+    controller.observe(task.get('priority'), timeout)
+    metrics.inc('server_request_timeouts_total', type=task.get('type'))
+    metrics.flush('server')
+
+
+def send_task_and_wait_for_response(task, request_topic, response_topic, timeout=30, timings=None):
     """
-    Отправляет задачу в Kafka и ожидает ответа с указанным correlation_id.
+    Отправляет задачу воркеру и ожидает ответа с указанным correlation_id.
+    Сама доставка выполняется транспортом, выбранным в Config.TRANSPORT_BACKEND
+    (по умолчанию Kafka).
 
     :param task: Словарь с данными задачи.
     :param request_topic: Топик для отправки задачи.
     :param response_topic: Топик, на который воркер отправит обработанный результат.
     :param timeout: Время ожидания ответа в секундах.
+    :param timings: metrics.StageTimings запроса, куда добавляются этапы транспорта и воркера.
     :return: Ответное сообщение (словарь) или выбрасывает TimeoutError.
     """
-    correlation_id = str(uuid.uuid4())
-    task['correlation_id'] = correlation_id
-    task['reply_to'] = response_topic
-
-    # Создаем KafkaProducer
-    producer = KafkaProducer(
-        bootstrap_servers=Config.KAFKA_BROKER_URL,
-        value_serializer=lambda v: json.dumps(v).encode('utf-8')
-    )
-    producer.send(request_topic, task)
-    producer.flush()
-
-    # Создаем KafkaConsumer для прослушивания reply-топика
-    consumer = KafkaConsumer(
-        response_topic,
-        bootstrap_servers=Config.KAFKA_BROKER_URL,
-        value_deserializer=lambda m: json.loads(m.decode('utf-8')),
-        auto_offset_reset='earliest',
-        consumer_timeout_ms=timeout * 1000  # таймаут в мс
-    )
-
-    response = None
-    for message in consumer:
-        msg = message.value
-        if msg.get('correlation_id') == correlation_id:
-            response = msg
-            break
-    consumer.close()
-
-    if response is None:
-        raise TimeoutError("Timeout waiting for Kafka response")
+    started_at = time.perf_counter()
+    try:
+        response = get_transport().send_task_and_wait_for_response(task, request_topic, response_topic,
+                                                                   timeout=timeout)
+    except TimeoutError:
+        record_timeout(task, timeout)
+        raise
+    record_response(task, response, time.perf_counter() - started_at, timings)
+    return response
+
+
+async def send_task_and_await_response(task, request_topic, response_topic, timeout=30, timings=None):
+    """
+    Асинхронный вариант send_task_and_wait_for_response: ожидание ответа – это
+    awaitable-обёртка над Future транспорта, поток на время ожидания не занимается.
+    """
+    started_at = time.perf_counter()
+    transport = get_transport()
+    future = transport.submit(task, request_topic, response_topic, timeout=timeout)
+    try:
+        response = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        transport.discard(task)
+        record_timeout(task, timeout)
+        raise TimeoutError("Timeout waiting for worker response")
+    record_response(task, response, time.perf_counter() - started_at, timings)
     return response
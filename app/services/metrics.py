@@ -0,0 +1,257 @@
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from app.config import Config
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_last_flush = 0.0
+_flusher = None  # (pid, поток) периодического сохранения снимка
+_local = threading.local()
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Увеличивает счётчик name с заданными метками (например, type='predict_file')."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """Устанавливает текущее значение индикатора (размер пакета, глубина очереди)."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    """Добавляет наблюдение в гистограмму name (границы корзин – Config.METRICS_BUCKETS)."""
+    key = _key(name, labels)
+    buckets = Config.METRICS_BUCKETS
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+        histogram['buckets'][bisect_left(buckets, value)] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+class StageTimings:
+    """
+    Времена этапов одного запроса (секунды). Каждый этап попадает и в гистограмму
+    stage_duration_seconds с метками запроса (task_type, model), и в словарь,
+    который передаётся вместе с correlation_id в ответе.
+    """
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        observe('stage_duration_seconds', seconds, stage=stage, **self.labels)
+
+    @contextmanager
+    def stage(self, name):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started_at)
+
+    def merge(self, stages, prefix=''):
+        """Добавляет в словарь этапы, измеренные в другом процессе (без повторной записи в гистограммы)."""
+        with self._lock:
+            for stage, seconds in (stages or {}).items():
+                self.stages[prefix + stage] = seconds
+
+    def as_dict(self):
+        with self._lock:
+            return {stage: round(seconds, 6) for stage, seconds in self.stages.items()}
+
+
+def current_timings():
+    """Времена этапов запроса, обрабатываемого в текущем потоке (или None)."""
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def activate(timings):
+    """Делает timings текущими для потока (нужно и во вспомогательных потоках запроса)."""
+    previous = current_timings()
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+@contextmanager
+def stage(name):
+    """
+    Замеряет этап текущего запроса. Используется в коде моделей и транспорта,
+    которому не передаётся объект запроса; вне запроса замер идёт только в гистограмму.
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started_at
+        timings = current_timings()
+        if timings is not None:
+            timings.add(name, elapsed)
+        else:
+            observe('stage_duration_seconds', elapsed, stage=name)
+
+
+def snapshot():
+    """Текущие значения метрик процесса в сериализуемом виде."""
+    with _lock:
+        return {
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in _counters.items()],
+            'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                       for (name, labels), value in _gauges.items()],
+            'histograms': [{'name': name, 'labels': dict(labels), 'buckets': list(h['buckets']),
+                            'sum': h['sum'], 'count': h['count']}
+                           for (name, labels), h in _histograms.items()],
+        }
+
+
+def _snapshot_path(role):
+    return os.path.join(Config.METRICS_DIR, f"{role}-{os.getpid()}.json")
+
+
+def flush(role, force=False):
+    """
+    Сохраняет снимок метрик процесса в Config.METRICS_DIR/<role>-<pid>.json
+    не чаще, чем раз в Config.METRICS_FLUSH_INTERVAL секунд. Так метрики воркера
+    и других серверных процессов становятся видны эндпоинту /metrics.
+    """
+    global _last_flush
+    _ensure_flusher(role)
+    now = time.time()
+    with _lock:
+        if not force and now - _last_flush < Config.METRICS_FLUSH_INTERVAL:
+            return
+        _last_flush = now
+    os.makedirs(Config.METRICS_DIR, exist_ok=True)
+    path = _snapshot_path(role)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def _flush_periodically(role):
+    while True:
+        time.sleep(Config.METRICS_FLUSH_INTERVAL)
+        try:
+            flush(role, force=True)
+        except OSError as e:
+            print(f"Ошибка сохранения метрик: {e}")
+
+
+def _ensure_flusher(role):
+    """
+    Запускает в процессе поток, который сохраняет снимок раз в Config.METRICS_FLUSH_INTERVAL:
+    так снимок простаивающего процесса не устаревает (индикаторы вроде server_inflight
+    обновляются и без новых запросов), а снимки завершённых процессов отсеиваются по возрасту.
+    """
+    global _flusher
+    with _lock:
+        if _flusher is not None and _flusher[0] == os.getpid() and _flusher[1].is_alive():
+            return
+        thread = threading.Thread(target=_flush_periodically, args=(role,), name='metrics-flush', daemon=True)
+        _flusher = (os.getpid(), thread)
+    thread.start()
+
+
+def _collect_snapshots(role):
+    """
+    Снимки всех процессов: свежий снимок текущего процесса и сохранённые снимки остальных.
+    Снимки старше Config.METRICS_SNAPSHOT_TTL (процесс завершён) пропускаются и удаляются.
+    """
+    own_path = os.path.abspath(_snapshot_path(role))
+    snapshots = [snapshot()]
+    now = time.time()
+    for path in glob.glob(os.path.join(Config.METRICS_DIR, '*.json')):
+        if os.path.abspath(path) == own_path:
+            continue
+        try:
+            if now - os.path.getmtime(path) > Config.METRICS_SNAPSHOT_TTL:
+                os.remove(path)
+                continue
+            with open(path, encoding='utf-8') as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _format_labels(labels, extra=None):
+    items = sorted(labels.items()) + (extra or [])
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + '}'
+
+
+def render_prometheus(role):
+    """
+    Объединяет метрики всех процессов (счётчики и гистограммы суммируются,
+    для индикаторов берётся сумма по процессам) и возвращает их в текстовом формате Prometheus.
+    """
+    counters, gauges, histograms = {}, {}, {}
+    for snap in _collect_snapshots(role):
+        for item in snap.get('counters', []):
+            key = _key(item['name'], item['labels'])
+            counters[key] = counters.get(key, 0) + item['value']
+        for item in snap.get('gauges', []):
+            key = _key(item['name'], item['labels'])
+            gauges[key] = gauges.get(key, 0) + item['value']
+        for item in snap.get('histograms', []):
+            key = _key(item['name'], item['labels'])
+            histogram = histograms.setdefault(key, {'buckets': [0] * len(item['buckets']), 'sum': 0.0, 'count': 0})
+            if len(histogram['buckets']) != len(item['buckets']):
+                continue  # снимок со старыми границами корзин
+            histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], item['buckets'])]
+            histogram['sum'] += item['sum']
+            histogram['count'] += item['count']
+
+    lines = []
+    for kind, values in (('counter', counters), ('gauge', gauges)):
+        declared = set()
+        for (name, labels), value in sorted(values.items()):
+            if name not in declared:
+                lines.append(f'# TYPE {name} {kind}')
+                declared.add(name)
+            lines.append(f'{name}{_format_labels(dict(labels))} {value}')
+
+    bounds = [str(bound) for bound in Config.METRICS_BUCKETS] + ['+Inf']
+    declared = set()
+    for (name, labels), histogram in sorted(histograms.items()):
+        if name not in declared:
+            lines.append(f'# TYPE {name} histogram')
+            declared.add(name)
+        labels = dict(labels)
+        cumulative = 0
+        for bound, count in zip(bounds, histogram['buckets']):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {histogram["sum"]}')
+        lines.append(f'{name}_count{_format_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
@@ -1,13 +1,19 @@
 import os
+import threading
+from collections import OrderedDict
 from app.config import Config
 from app.models.sentiment_model import SentimentModel
 
+# Загруженные модели (последние использованные – в конце), не больше Config.LOADED_MODELS_LIMIT
+_loaded_models = OrderedDict()
+_loaded_models_lock = threading.Lock()
+
 
 def list_available_models():
     """
     Возвращает список доступных моделей, представленных папками,
     найденных в папке, указанной в Config.MODEL_CACHE_DIR.
-    Скрытые папки (начинающиеся с точки) исключаются.
+    Скрытые папки (начинающиеся с точки) и папка артефактов классической части ансамбля исключаются.
     Если имя папки начинается с "models--", то возвращается нормализованное имя:
       - префикс "models--" удаляется,
       - оставшиеся вхождения "--" заменяются на "/".
@@ -19,6 +25,8 @@ def list_available_models():
         if item.startswith('.'):
             continue
         item_path = os.path.join(Config.MODEL_CACHE_DIR, item)
+        if os.path.normpath(item_path) == os.path.normpath(Config.CLASSIC_ARTIFACTS_DIR):
+            continue
         if os.path.isdir(item_path):
             if item.startswith("models--"):
                 normalized_name = item[len("models--"):].replace("--", "/")
@@ -28,17 +36,39 @@ def list_available_models():
     return models
 
 
+def model_label(model_name):
+    """
+    Метка модели для метрик: 'default', имя доступной модели или 'unknown'.
+    Имя из запроса не становится меткой без проверки, чтобы число рядов метрик было ограничено.
+    """
+    if not model_name:
+        return 'default'
+    return model_name if model_name in list_available_models() else 'unknown'
+
+
 def select_model(model_name=None):
     """
     Если model_name передано и присутствует в MODEL_CACHE_DIR,
     то модель загружается из соответствующей папки.
     Иначе используется модель по умолчанию.
+    Загруженные модели переиспользуются между задачами: в памяти остаются
+    Config.LOADED_MODELS_LIMIT последних использованных.
     """
     if model_name:
         available = list_available_models()
         if model_name not in available:
             raise Exception(f"Запрошенная модель '{model_name}' недоступна. Доступны: {available}")
-        return SentimentModel(model_path=model_name)
+        model_path = model_name
     else:
-        return SentimentModel(model_path=Config.DEFAULT_MODEL_NAME)
+        model_path = Config.DEFAULT_MODEL_NAME
+
+    with _loaded_models_lock:
+        model = _loaded_models.get(model_path)
+        if model is None:
+            model = SentimentModel(model_path=model_path)
+            _loaded_models[model_path] = model
+            while len(_loaded_models) > Config.LOADED_MODELS_LIMIT:
+                _loaded_models.popitem(last=False)
+        _loaded_models.move_to_end(model_path)
+        return model
 
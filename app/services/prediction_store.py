@@ -0,0 +1,350 @@
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from app.config import Config
+from app.services import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    text_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    model_version TEXT,
+    label TEXT NOT NULL,
+    score REAL,
+    source TEXT,
+    request_id TEXT,
+    attributes TEXT
+);
+CREATE INDEX IF NOT EXISTS predictions_created_at ON predictions (created_at);
+CREATE INDEX IF NOT EXISTS predictions_text_hash ON predictions (text_hash, model, model_version);
+
+-- Сводки: period 'h' – почасовые (slot = часы epoch), 'd' – посуточные (slot = сутки epoch)
+CREATE TABLE IF NOT EXISTS label_counts (
+    period TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    label TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (period, slot, model, model_version, label)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS column_counts (
+    column_name TEXT NOT NULL,
+    period TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    model TEXT NOT NULL,
+    label TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (column_name, period, slot, value, model, label)
+) WITHOUT ROWID;
+
+-- Разные значения столбцов за всё время (для ограничения числа значений в column_counts)
+-- и столбцы, которые из-за числа значений больше не сводятся
+CREATE TABLE IF NOT EXISTS column_values (
+    column_name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (column_name, value)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS skipped_columns (
+    column_name TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+PERIOD_SECONDS = {'h': 3600, 'd': 86400}
+
+
+def _hour_bucket(slot):
+    return datetime.fromtimestamp(slot * 3600, timezone.utc).strftime('%Y-%m-%dT%H:00:00Z')
+
+
+def _day(slot):
+    return datetime.fromtimestamp(slot * 86400, timezone.utc).date()
+
+
+# Окна агрегации (время UTC): из какой сводки читать и как назвать окно, в которое попадает slot
+WINDOWS = {
+    'hour': ('h', _hour_bucket),
+    'day': ('d', lambda slot: _day(slot).isoformat()),
+    'week': ('d', lambda slot: (_day(slot) - timedelta(days=_day(slot).weekday())).isoformat()),
+    'month': ('d', lambda slot: _day(slot).strftime('%Y-%m')),
+}
+
+_STOP = object()
+
+
+def text_hash(text):
+    return hashlib.blake2b(str(text).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _attribute_value(value):
+    """Значение столбца для группировки: строка не длиннее 200 символов, пустые ячейки – ''."""
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    return str(value)[:200]
+
+
+class PredictionStore:
+    """
+    Хранилище предсказаний в SQLite.
+
+    Каждое предсказание дописывается в таблицу predictions (только добавление) с хешем текста,
+    моделью, версией модели и временем. Одновременно обновляются почасовые и посуточные сводные
+    таблицы: label_counts (число меток по модели) и column_counts (число меток по значению каждого
+    столбца исходного файла). Агрегирующие запросы читают только сводные таблицы, поэтому
+    их время не зависит от числа сохранённых строк.
+
+    Запись выполняется фоновым потоком пакетами, чтобы не задерживать ответ; если очередь
+    переполнена, пакет отбрасывается (с метрикой), а не блокирует запрос.
+    Несколько процессов сервера могут писать в один файл (режим WAL).
+    """
+
+    def __init__(self, path=None):
+        self.path = path or Config.PREDICTION_STORE_PATH
+        self._queue = queue.Queue(maxsize=Config.PREDICTION_STORE_QUEUE_SIZE)
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._local = threading.local()
+        self._schema_ready = False
+
+    def _connect(self):
+        """Соединение текущего потока (sqlite3 не разделяет соединения между потоками)."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            if not self._schema_ready:
+                connection.executescript(SCHEMA)
+                self._schema_ready = True
+            self._local.connection = connection
+        return connection
+
+    def record(self, labels, model, texts, scores=None, model_version=None, source=None,
+               request_id=None, columns=None):
+        """
+        Ставит в очередь на запись пакет предсказаний одной модели.
+
+        :param labels: Метки (буквы B/G/N).
+        :param model: Имя модели ('ensemble' для ансамбля).
+        :param texts: Исходные тексты (сохраняется только их хеш).
+        :param scores: Уверенность модели для каждой строки или None.
+        :param model_version: Версия модели из ответа воркера.
+        :param source: Откуда пришли предсказания (тип задачи).
+        :param request_id: correlation_id задачи.
+        :param columns: {имя столбца: значения} – остальные столбцы файла для агрегатов.
+        """
+        if not Config.PREDICTION_STORE_ENABLED or not labels:
+            return
+        batch = {
+            'created_at': time.time(),
+            'labels': list(labels),
+            'model': model,
+            'texts': list(texts),
+            'scores': list(scores) if scores is not None else None,
+            'model_version': model_version or '',
+            'source': source,
+            'request_id': request_id,
+            'columns': columns or {},
+        }
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(batch)
+        except queue.Full:
+            metrics.inc('prediction_store_dropped_total', len(batch['labels']))
+
+    def _ensure_writer(self):
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            batches = [self._queue.get()]
+            # Всё, что накопилось в очереди, записывается одной транзакцией
+            while len(batches) < 64:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(batch is _STOP for batch in batches)
+            batches = [batch for batch in batches if batch is not _STOP]
+            if batches:
+                try:
+                    self.write(batches)
+                except Exception as e:
+                    metrics.inc('prediction_store_errors_total')
+                    print(f"Ошибка записи предсказаний: {e}")
+            if stop:
+                return
+
+    def write(self, batches):
+        """Синхронно записывает пакеты предсказаний (формат record) в сырую и сводные таблицы."""
+        started_at = time.perf_counter()
+        rows = []
+        label_counts = Counter()
+        prepared = []
+        values_by_column = {}
+        for batch in batches:
+            slots = {period: int(batch['created_at'] // seconds) for period, seconds in PERIOD_SECONDS.items()}
+            labels = batch['labels']
+            scores = batch['scores'] or [None] * len(labels)
+            columns = {
+                name: [_attribute_value(value) for value in values]
+                for name, values in batch['columns'].items()
+            }
+            for name, values in columns.items():
+                values_by_column.setdefault(name, set()).update(values)
+            for i, (label, text, score) in enumerate(zip(labels, batch['texts'], scores)):
+                attributes = {name: values[i] for name, values in columns.items()}
+                rows.append((
+                    batch['created_at'], text_hash(text), batch['model'], batch['model_version'], label,
+                    None if score is None else float(score), batch['source'], batch['request_id'],
+                    json.dumps(attributes, ensure_ascii=False) if attributes else None,
+                ))
+                for period, slot in slots.items():
+                    label_counts[(period, slot, batch['model'], batch['model_version'], label)] += 1
+            prepared.append((batch, slots, columns))
+
+        connection = self._connect()
+        with connection:
+            grouped = self._grouped_columns(connection, values_by_column)
+            column_counts = Counter()
+            for batch, slots, columns in prepared:
+                for name in grouped.intersection(columns):
+                    for value, label in zip(columns[name], batch['labels']):
+                        for period, slot in slots.items():
+                            column_counts[(name, period, slot, value, batch['model'], label)] += 1
+            connection.executemany(
+                "INSERT INTO predictions (created_at, text_hash, model, model_version, label, score, source, "
+                "request_id, attributes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            connection.executemany(
+                "INSERT INTO label_counts (period, slot, model, model_version, label, count) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (period, slot, model, model_version, label) DO UPDATE SET count = count + excluded.count",
+                [key + (count,) for key, count in label_counts.items()])
+            connection.executemany(
+                "INSERT INTO column_counts (column_name, period, slot, value, model, label, count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (column_name, period, slot, value, model, label) "
+                "DO UPDATE SET count = count + excluded.count",
+                [key + (count,) for key, count in column_counts.items()])
+        metrics.inc('prediction_store_rows_total', len(rows))
+        metrics.observe('prediction_store_write_seconds', time.perf_counter() - started_at)
+
+    def _grouped_columns(self, connection, values_by_column):
+        """
+        Столбцы, по которым обновляются сводки column_counts. Разные значения столбца считаются
+        по всем записанным пакетам (таблица column_values), а не по одному пакету: столбец, у которого
+        их набралось больше Config.PREDICTION_STORE_MAX_COLUMN_VALUES (идентификаторы, время, тексты),
+        больше не сводится, и его сводки удаляются – иначе column_counts росла бы так же, как сырая таблица.
+        """
+        limit = Config.PREDICTION_STORE_MAX_COLUMN_VALUES
+        skipped = {name for (name,) in connection.execute("SELECT column_name FROM skipped_columns")}
+        grouped = set()
+        for name, values in values_by_column.items():
+            if name in skipped:
+                continue
+            count = len(values)
+            if count <= limit:
+                connection.executemany("INSERT OR IGNORE INTO column_values (column_name, value) VALUES (?, ?)",
+                                       [(name, value) for value in values])
+                (count,) = connection.execute(
+                    "SELECT COUNT(*) FROM column_values WHERE column_name = ?", (name,)).fetchone()
+            if count > limit:
+                connection.execute("INSERT OR IGNORE INTO skipped_columns (column_name) VALUES (?)", (name,))
+                connection.execute("DELETE FROM column_values WHERE column_name = ?", (name,))
+                connection.execute("DELETE FROM column_counts WHERE column_name = ?", (name,))
+            else:
+                grouped.add(name)
+        return grouped
+
+    def flush(self, timeout=10):
+        """Дожидается записи всего, что уже поставлено в очередь (тесты, завершение процесса)."""
+        deadline = time.time() + timeout
+        while not self._queue.empty() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        """Останавливает фоновую запись после обработки очереди."""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+
+    def aggregate(self, window='day', start=None, end=None, model=None, column=None):
+        """
+        Распределение меток по окнам времени.
+
+        :param window: 'hour', 'day', 'week' или 'month' (UTC).
+        :param start: Начало интервала (секунды epoch) или None.
+        :param end: Конец интервала (секунды epoch, не включительно) или None.
+            Для окон от суток и больше границы округляются до целых суток.
+        :param model: Только эта модель или все.
+        :param column: Если задан – группировка по значению этого столбца исходного файла,
+            иначе – по модели и версии модели.
+        :return: Список {'bucket', 'group', 'counts': {метка: число}, 'total'}, упорядоченный по окну и группе.
+        """
+        if window not in WINDOWS:
+            raise ValueError(f"Неизвестное окно '{window}'. Доступны: {list(WINDOWS)}")
+        period, bucket_name = WINDOWS[window]
+        seconds = PERIOD_SECONDS[period]
+        if column is not None:
+            table, group = "column_counts", "value"
+            conditions, params = ["column_name = ?", "period = ?"], [column, period]
+        else:
+            table, group = "label_counts", "model || CASE WHEN model_version = '' THEN '' ELSE '@' || model_version END"
+            conditions, params = ["period = ?"], [period]
+        if start is not None:
+            conditions.append("slot >= ?")
+            params.append(int(start // seconds))
+        if end is not None:
+            conditions.append("slot < ?")
+            params.append(int(-(-end // seconds)))
+        if model is not None:
+            conditions.append("model = ?")
+            params.append(model)
+        query = (f"SELECT slot, {group}, label, SUM(count) FROM {table} WHERE {' AND '.join(conditions)} "
+                 f"GROUP BY slot, {group}, label")
+
+        # Сводки читаются по часам или суткам, а в недели и месяцы собираются здесь
+        bucket_names = {}
+        series = {}
+        for slot, grp, label, count in self._connect().execute(query, params):
+            bucket = bucket_names.get(slot)
+            if bucket is None:
+                bucket = bucket_names[slot] = bucket_name(slot)
+            item = series.setdefault((bucket, grp), {'bucket': bucket, 'group': grp, 'counts': {}, 'total': 0})
+            item['counts'][label] = item['counts'].get(label, 0) + count
+            item['total'] += count
+        return [series[key] for key in sorted(series)]
+
+    def columns(self):
+        """Имена столбцов исходных файлов, по которым есть агрегаты."""
+        rows = self._connect().execute("SELECT DISTINCT column_name FROM column_counts ORDER BY column_name")
+        return [name for (name,) in rows]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Хранилище предсказаний процесса (Config.PREDICTION_STORE_PATH), создаётся один раз."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PredictionStore()
+        return _store
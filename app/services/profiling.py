@@ -0,0 +1,170 @@
+import cProfile
+import os
+import pstats
+import random
+import threading
+import time
+
+from app.config import Config
+from app.services import metrics
+
+try:
+    from torch import profiler as torch_profiler
+except ImportError:  # без torch профилируется только cProfile
+    torch_profiler = None
+
+# Задачи, для которых поддерживается флаг 'profile'
+PROFILED_TASK_TYPES = {'predict_text', 'predict_file'}
+
+# Этапы пайплайна трансформера, доли которых показываются в сводке
+PIPELINE_STAGES = ('tokenize', 'forward', 'postprocess')
+
+# ThreadProfiles профилируемой задачи – только в потоке, который её выполняет
+_local = threading.local()
+
+
+def should_profile(task):
+    """
+    Нужно ли профилировать задачу: профилирование включено в Config.PROFILING_ENABLED,
+    в задаче выставлен флаг 'profile' и задача попала в выборку Config.PROFILING_SAMPLE_RATE.
+    """
+    if not Config.PROFILING_ENABLED or not task.get('profile'):
+        return False
+    if task.get('type') not in PROFILED_TASK_TYPES:
+        return False
+    return random.random() < Config.PROFILING_SAMPLE_RATE
+
+
+class ThreadProfiles:
+    """
+    Профили вспомогательных потоков профилируемой задачи. cProfile видит только поток,
+    в котором включён, поэтому код, запускающий потоки этапов (BulkInferenceEngine), явно
+    оборачивает их цели в wrap(): поток выполняется под своим cProfile, а его профиль
+    объединяется с профилем задачи. Потоки должны завершиться (join) до конца задачи.
+    """
+
+    def __init__(self):
+        self.profilers = []
+        self._lock = threading.Lock()
+
+    def wrap(self, target):
+        def run(*args, **kwargs):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Начиная с Python 3.12 профилировщик задачи и так видит все потоки
+                return target(*args, **kwargs)
+            try:
+                return target(*args, **kwargs)
+            finally:
+                profiler.disable()
+                with self._lock:
+                    self.profilers.append(profiler)
+        return run
+
+
+def current_thread_profiles():
+    """ThreadProfiles задачи, которую профилирует текущий поток, или None."""
+    return getattr(_local, 'thread_profiles', None)
+
+
+def _top_functions(stats, limit):
+    """Функции с наибольшим собственным временем по данным cProfile (pstats.Stats)."""
+    rows = []
+    for (filename, line, name), (_, calls, own_time, cumulative_time, _) in stats.stats.items():
+        rows.append({
+            'function': f"{os.path.basename(filename)}:{line}({name})",
+            'calls': calls,
+            'own_time': round(own_time, 6),
+            'cumulative_time': round(cumulative_time, 6),
+        })
+    rows.sort(key=lambda row: row['own_time'], reverse=True)
+    return rows[:limit]
+
+
+def _top_operators(profile, limit):
+    """Операторы torch с наибольшим собственным временем CPU (секунды)."""
+    rows = [{
+        'operator': event.key,
+        'calls': event.count,
+        'self_cpu_time': round(event.self_cpu_time_total / 1e6, 6),
+        'cpu_time': round(event.cpu_time_total / 1e6, 6),
+    } for event in profile.key_averages()]
+    rows.sort(key=lambda row: row['self_cpu_time'], reverse=True)
+    return rows[:limit]
+
+
+def _stage_shares(stages):
+    """Доли токенизации, прямого прохода и постобработки во времени инференса."""
+    total = stages.get('inference') or sum(stages.get(stage, 0.0) for stage in PIPELINE_STAGES)
+    if not total:
+        return {}
+    return {stage: round(stages[stage] / total, 4) for stage in PIPELINE_STAGES if stage in stages}
+
+
+def _prune_profiles():
+    """Оставляет в Config.PROFILES_DIR только Config.PROFILES_KEEP последних профилей."""
+    paths = sorted(
+        (os.path.join(Config.PROFILES_DIR, name) for name in os.listdir(Config.PROFILES_DIR)),
+        key=os.path.getmtime,
+    )
+    profiles = {}
+    for path in paths:
+        profiles.setdefault(os.path.basename(path).split('.')[0], []).append(path)
+    for name in list(profiles)[:-Config.PROFILES_KEEP]:
+        for path in profiles[name]:
+            os.remove(path)
+
+
+def run_profiled(func, task, timings):
+    """
+    Выполняет func(task) под cProfile и (если доступен и включён Config.PROFILING_TORCH)
+    torch.profiler. Профили вспомогательных потоков задачи (ThreadProfiles) объединяются
+    с профилем задачи. Профили сохраняются в Config.PROFILES_DIR под именем задачи:
+    <имя>.prof (открывается pstats/snakeviz) и <имя>.trace.json (chrome://tracing, Perfetto).
+
+    :param timings: metrics.StageTimings задачи – из них берутся доли этапов пайплайна.
+    :return: Пара (результат func, сводка профиля для ответа).
+    """
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{task.get('correlation_id') or 'task'}"
+    os.makedirs(Config.PROFILES_DIR, exist_ok=True)
+
+    torch_profile = None
+    if Config.PROFILING_TORCH and torch_profiler is not None:
+        torch_profile = torch_profiler.profile(activities=[torch_profiler.ProfilerActivity.CPU])
+
+    thread_profiles = ThreadProfiles()
+    profiler = cProfile.Profile()
+    if torch_profile is not None:
+        torch_profile.__enter__()
+    _local.thread_profiles = thread_profiles
+    profiler.enable()
+    try:
+        result = func(task)
+    finally:
+        profiler.disable()
+        _local.thread_profiles = None
+        if torch_profile is not None:
+            torch_profile.__exit__(None, None, None)
+
+    stats = pstats.Stats(profiler)
+    for thread_profile in thread_profiles.profilers:
+        stats.add(thread_profile)
+    files = {'cprofile': f"{name}.prof"}
+    stats.dump_stats(os.path.join(Config.PROFILES_DIR, files['cprofile']))
+    summary = {
+        'name': name,
+        'top_functions': _top_functions(stats, Config.PROFILING_TOP_N),
+        'stage_shares': _stage_shares(timings.as_dict()),
+        'profiled_threads': 1 + len(thread_profiles.profilers),
+    }
+    if torch_profile is not None:
+        files['torch_trace'] = f"{name}.trace.json"
+        torch_profile.export_chrome_trace(os.path.join(Config.PROFILES_DIR, files['torch_trace']))
+        summary['top_operators'] = _top_operators(torch_profile, Config.PROFILING_TOP_N)
+    summary['files'] = files
+
+    _prune_profiles()
+    metrics.inc('worker_profiles_total', type=task.get('type'))
+    return result, summary
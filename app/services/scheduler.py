@@ -0,0 +1,120 @@
+import heapq
+import itertools
+import threading
+import time
+
+from app.config import Config
+from app.services import metrics
+
+# Полосы приоритета: интерактивные задачи по одному тексту обслуживаются раньше пакетных
+LANE_INTERACTIVE = 'interactive'
+LANE_BULK = 'bulk'
+LANE_RANK = {LANE_INTERACTIVE: 0, LANE_BULK: 1}
+
+INTERACTIVE_TASK_TYPES = {'predict_text', 'predict_text_ensemble'}
+
+
+def task_lane(task):
+    """Полоса задачи: явно заданная в 'priority' или выведенная из её типа."""
+    lane = task.get('priority')
+    if lane in LANE_RANK:
+        return lane
+    return LANE_INTERACTIVE if task.get('type') in INTERACTIVE_TASK_TYPES else LANE_BULK
+
+
+def is_expired(task, now=None):
+    """
+    Истёк ли абсолютный дедлайн задачи (секунды epoch, поле 'deadline').
+    Задачи без дедлайна (от старых отправителей) не истекают.
+    """
+    deadline = task.get('deadline')
+    if deadline is None:
+        return False
+    return (now or time.time()) > deadline
+
+
+class TaskScheduler:
+    """
+    Буфер задач воркера с приоритетами.
+
+    Фоновый поток вычитывает задачи из транспорта в кучу, упорядоченную по
+    (полоса, дедлайн, порядок поступления): интерактивные задачи идут раньше пакетных,
+    внутри полосы – по ближайшему дедлайну. Просроченные задачи отбрасываются при
+    поступлении и перед выдачей, не доходя до инференса; их число учитывается
+    в метрике worker_tasks_expired_total.
+    """
+
+    def __init__(self, tasks, capacity=None, on_idle=None):
+        """
+        :param tasks: Итератор задач (transport.consume(...)).
+        :param capacity: Сколько задач держать в буфере (Config.WORKER_PREFETCH),
+            при заполнении чтение из транспорта приостанавливается.
+        :param on_idle: Фоновая работа воркера (функция без аргументов), которая выполняется,
+            когда буфер пуст; возвращает True, если что-то сделала, иначе планировщик ждёт задач.
+        """
+        self._tasks = tasks
+        self._capacity = capacity or Config.WORKER_PREFETCH
+        self._on_idle = on_idle
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read, name='task-scheduler', daemon=True)
+        self._reader.start()
+
+    def _shed(self, task):
+        metrics.inc('worker_tasks_expired_total', type=task.get('type'), lane=task_lane(task))
+        metrics.flush('worker')
+
+    def _read(self):
+        try:
+            for task in self._tasks:
+                if is_expired(task):
+                    self._shed(task)
+                    continue
+                deadline = task.get('deadline')
+                entry = (LANE_RANK[task_lane(task)], deadline if deadline is not None else float('inf'),
+                         next(self._seq), task)
+                with self._cond:
+                    while len(self._heap) >= self._capacity:
+                        self._cond.wait()
+                    heapq.heappush(self._heap, entry)
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            with self._cond:
+                idle = not self._heap and not self._closed
+            if idle and self._on_idle is not None and self._on_idle():
+                continue
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if not self._heap:
+                    raise StopIteration
+                task = heapq.heappop(self._heap)[-1]
+                self._cond.notify_all()
+            if is_expired(task):
+                self._shed(task)
+                continue
+            return task
+
+    def has_tasks(self):
+        """Есть ли в буфере задачи (фоновая работа в простое по этому признаку прерывается)."""
+        with self._cond:
+            return bool(self._heap)
+
+    def depth(self):
+        """Количество задач в буфере по полосам."""
+        with self._cond:
+            depth = {lane: 0 for lane in LANE_RANK}
+            for _, _, _, task in self._heap:
+                depth[task_lane(task)] += 1
+            return depth
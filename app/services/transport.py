@@ -0,0 +1,312 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from kafka import KafkaConsumer, KafkaProducer
+from app.config import Config
+from app.services import codec
+from app.services.scheduler import task_lane
+
+
+class Transport:
+    """
+    Базовый транспорт между HTTP-частью и воркером.
+
+    Сторона сервера вызывает submit (ответ приходит в Future) или
+    send_task_and_wait_for_response, сторона воркера – consume (итератор задач)
+    и reply (отправка ответа в reply-топик).
+    Формат задач и ответов (словари с 'correlation_id' и 'reply_to') одинаков для всех бэкендов;
+    на границе процессов сообщения кодируются app.services.codec. Ответ кодируется в формате,
+    который выбрал воркер по 'wire_accept' задачи (см. codec.reply_options).
+    """
+
+    def prepare(self, response_topics):
+        """Заранее готовит приём ответов из указанных топиков (вызывается при старте сервера)."""
+
+    def submit(self, task, request_topic, response_topic, timeout=30):
+        raise NotImplementedError
+
+    def discard(self, task):
+        """Перестаёт ждать ответ на задачу (после таймаута)."""
+
+    def send_task_and_wait_for_response(self, task, request_topic, response_topic, timeout=30):
+        future = self.submit(task, request_topic, response_topic, timeout=timeout)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.discard(task)
+            raise TimeoutError("Timeout waiting for worker response")
+
+    def consume(self, topics):
+        raise NotImplementedError
+
+    def reply(self, topic, response, wire_format='json', compression=None):
+        raise NotImplementedError
+
+    @staticmethod
+    def _prepare_task(task, response_topic, timeout):
+        """
+        Дополняет задачу служебными полями: correlation_id, reply-топиком, поддерживаемыми
+        форматами ответа, абсолютным дедлайном (время epoch, после которого ответ никому
+        не нужен) и полосой приоритета ('interactive' или 'bulk').
+        """
+        correlation_id = str(uuid.uuid4())
+        task['correlation_id'] = correlation_id
+        task['reply_to'] = response_topic
+        task['wire_accept'] = codec.accepted_features()
+        task.setdefault('deadline', time.time() + timeout)
+        task.setdefault('priority', task_lane(task))
+        return correlation_id
+
+    @staticmethod
+    def _encode_task(task):
+        return codec.encode(task, compression=Config.WIRE_COMPRESSION)
+
+
+class _ReplyRouter:
+    """Сопоставляет ответы воркера ожидающим запросам по correlation_id."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def register(self, correlation_id):
+        future = Future()
+        with self._lock:
+            self._pending[correlation_id] = future
+        return future
+
+    def discard(self, correlation_id):
+        with self._lock:
+            self._pending.pop(correlation_id, None)
+
+    def resolve(self, response):
+        with self._lock:
+            future = self._pending.pop(response.get('correlation_id'), None)
+        # Ответы на уже отменённые (просроченные) запросы просто отбрасываются
+        if future is not None and future.set_running_or_notify_cancel():
+            future.set_result(response)
+
+
+class _FutureTransport(Transport):
+    """
+    Общая логика бэкендов: Future регистрируется по correlation_id до отправки задачи,
+    а поток-диспетчер процесса передаёт в него ответ. Ожидание ответа не требует
+    отдельного потока или потребителя на каждый запрос, поэтому подходит и для asyncio.
+    """
+
+    def __init__(self):
+        self._router = _ReplyRouter()
+
+    def _put_task(self, request_topic, task):
+        raise NotImplementedError
+
+    def _ensure_dispatcher(self, response_topic):
+        pass
+
+    def prepare(self, response_topics):
+        for response_topic in response_topics:
+            self._ensure_dispatcher(response_topic)
+
+    def submit(self, task, request_topic, response_topic, timeout=30):
+        self._ensure_dispatcher(response_topic)
+        correlation_id = self._prepare_task(task, response_topic, timeout)
+        future = self._router.register(correlation_id)
+        self._put_task(request_topic, task)
+        return future
+
+    def discard(self, task):
+        self._router.discard(task.get('correlation_id'))
+
+
+class KafkaTransport(_FutureTransport):
+    """
+    Задачи и ответы передаются через Kafka. В каждом серверном процессе на каждый
+    reply-топик работает один потребитель, который раздаёт ответы ожидающим запросам.
+    """
+
+    def __init__(self, broker_url=None):
+        super().__init__()
+        self.broker_url = broker_url or Config.KAFKA_BROKER_URL
+        self._producer = None
+        self._lock = threading.Lock()
+        self._reply_consumers = {}  # reply-топик -> pid процесса, где запущен диспетчер
+
+    def _get_producer(self):
+        with self._lock:
+            if self._producer is None:
+                self._producer = KafkaProducer(bootstrap_servers=self.broker_url)
+            return self._producer
+
+    def _ensure_dispatcher(self, response_topic):
+        with self._lock:
+            if self._reply_consumers.get(response_topic) == os.getpid():
+                return
+            consumer = KafkaConsumer(
+                response_topic,
+                bootstrap_servers=self.broker_url,
+                value_deserializer=codec.decode,
+                auto_offset_reset='earliest'
+            )
+            # Дожидаемся назначения партиций и переходим в их конец до отправки первой задачи,
+            # чтобы не пропустить ответ и не перечитывать старые. Если топика ещё нет,
+            # его партиции появятся позже и будут прочитаны с начала.
+            deadline = time.time() + Config.KAFKA_REPLY_ASSIGN_TIMEOUT
+            while not consumer.assignment() and time.time() < deadline:
+                consumer.poll(timeout_ms=100)
+            if consumer.assignment():
+                consumer.seek_to_end()
+                for partition in consumer.assignment():
+                    consumer.position(partition)
+            thread = threading.Thread(target=self._dispatch_replies, args=(consumer,),
+                                      name=f'kafka-replies-{response_topic}', daemon=True)
+            thread.start()
+            self._reply_consumers[response_topic] = os.getpid()
+
+    def _dispatch_replies(self, consumer):
+        for message in consumer:
+            self._router.resolve(message.value)
+
+    def _put_task(self, request_topic, task):
+        # send не блокирует: сообщение уходит из фонового потока продюсера
+        self._get_producer().send(request_topic, self._encode_task(task))
+
+    def consume(self, topics):
+        consumer = KafkaConsumer(
+            *topics,
+            bootstrap_servers=self.broker_url,
+            value_deserializer=codec.decode,
+            auto_offset_reset='earliest',
+            # Группа фиксирует смещения, поэтому перезапущенный воркер не перечитывает весь топик
+            group_id=Config.KAFKA_WORKER_GROUP
+        )
+        for message in consumer:
+            yield message.value
+
+    def reply(self, topic, response, wire_format='json', compression=None):
+        producer = self._get_producer()
+        producer.send(topic, codec.encode(response, wire_format, compression))
+        producer.flush()
+
+
+class LocalTransport(_FutureTransport):
+    """
+    Транспорт для одного узла без брокера: очереди multiprocessing между процессом
+    Flask и процессом воркера. Объект нужно создать в родительском процессе до запуска
+    воркера (см. main.py), чтобы обе стороны работали с одними и теми же очередями.
+    Ответы читает один поток-диспетчер в серверном процессе, поэтому бэкенд рассчитан
+    на один серверный процесс.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.request_queue = multiprocessing.Queue()
+        self.reply_queue = multiprocessing.Queue()
+        self._dispatcher_lock = threading.Lock()
+        self._dispatcher_pid = None
+
+    def __getstate__(self):
+        # В дочерний процесс передаются только очереди
+        return {'request_queue': self.request_queue, 'reply_queue': self.reply_queue}
+
+    def __setstate__(self, state):
+        _FutureTransport.__init__(self)
+        self.request_queue = state['request_queue']
+        self.reply_queue = state['reply_queue']
+        self._dispatcher_lock = threading.Lock()
+        self._dispatcher_pid = None
+
+    def _ensure_dispatcher(self, response_topic):
+        # Потоки не переживают fork, поэтому диспетчер запускается в том процессе, где ждут ответов
+        with self._dispatcher_lock:
+            if self._dispatcher_pid == os.getpid():
+                return
+            thread = threading.Thread(target=self._dispatch_replies, name='local-transport-replies', daemon=True)
+            thread.start()
+            self._dispatcher_pid = os.getpid()
+
+    def _dispatch_replies(self):
+        while True:
+            _, data = self.reply_queue.get()
+            self._router.resolve(codec.decode(data))
+
+    def _put_task(self, request_topic, task):
+        self.request_queue.put((request_topic, self._encode_task(task)))
+
+    def consume(self, topics):
+        while True:
+            topic, data = self.request_queue.get()
+            if topic in topics:
+                yield codec.decode(data)
+
+    def reply(self, topic, response, wire_format='json', compression=None):
+        self.reply_queue.put((topic, codec.encode(response, wire_format, compression)))
+
+
+class InMemoryTransport(_FutureTransport):
+    """
+    Транспорт внутри одного процесса (тесты, бенчмарки): воркер запускается в потоке
+    и получает задачи из queue.Queue, ответы сразу передаются ожидающему запросу.
+    Задачи и ответы проходят через кодек, чтобы поведение совпадало с Kafka.
+    """
+
+    _STOP = object()
+
+    def __init__(self):
+        super().__init__()
+        self.request_queue = queue.Queue()
+
+    def _put_task(self, request_topic, task):
+        self.request_queue.put((request_topic, codec.decode(self._encode_task(task))))
+
+    def consume(self, topics):
+        while True:
+            item = self.request_queue.get()
+            if item is self._STOP:
+                return
+            topic, task = item
+            if topic in topics:
+                yield task
+
+    def reply(self, topic, response, wire_format='json', compression=None):
+        self._router.resolve(codec.decode(codec.encode(response, wire_format, compression)))
+
+    def close(self):
+        """Завершает итератор consume (останавливает воркер, запущенный в потоке)."""
+        self.request_queue.put(self._STOP)
+
+
+TRANSPORT_BACKENDS = {
+    'kafka': KafkaTransport,
+    'local': LocalTransport,
+    'memory': InMemoryTransport,
+}
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    Возвращает транспорт процесса, выбранный в Config.TRANSPORT_BACKEND
+    ('kafka', 'local' или 'memory'). Экземпляр создаётся один раз.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            backend = Config.TRANSPORT_BACKEND
+            if backend not in TRANSPORT_BACKENDS:
+                raise ValueError(f"Неизвестный транспорт '{backend}'. Доступны: {list(TRANSPORT_BACKENDS)}")
+            _transport = TRANSPORT_BACKENDS[backend]()
+        return _transport
+
+
+def set_transport(transport):
+    """Подменяет транспорт процесса (например, InMemoryTransport в тестах или переданный воркеру)."""
+    global _transport
+    with _transport_lock:
+        _transport = transport
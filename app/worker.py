@@ -1,96 +1,268 @@
-import json
-from kafka import KafkaConsumer, KafkaProducer
+import queue
+import threading
+import time
 from app.config import Config
 from app.models.ensemble_sentiment_model import EnsembleSentimentModel
-from app.services.model_selector import select_model
+from app.services.model_selector import model_label, select_model
+from app.services.classic_trainer import IncrementalClassicTrainer
+from app.services.fanout import run_fanout
+from app.services.transport import get_transport, set_transport
+from app.services.codec import reply_options
+from app.services.scheduler import TaskScheduler, is_expired, task_lane
+from app.services import autotuner, metrics, profiling
 
 
-def start_worker():
+def load_ensemble_model():
+    """Создаёт ансамблевую модель и подгружает логистическую и мета-модель из кеша."""
+    model = EnsembleSentimentModel()
+    model.load_cached_models()
+    return model
+
+
+def handle_task(task):
+    """
+    Выполняет одну задачу и возвращает пару (ответ, reply-топик).
+    Этапы обработки (загрузка модели, инференс и этапы внутри моделей) замеряются
+    в metrics.current_timings(), если они активированы вызывающим.
+    """
+    correlation_id = task.get('correlation_id')
+    task_type = task.get('type')
+
+    if task_type == 'prepare_dataset':
+        processed_data = task.get('data')
+        response = {
+            'correlation_id': correlation_id,
+            'processed_data': processed_data
+        }
+        reply_to = task.get('reply_to', 'dataset_response')
+
+    elif task_type == 'predict_text':
+        # Инференс для одиночного текста
+        text = task.get('text')
+        model_name = task.get('model_name')  # получаем имя модели из задачи
+        try:
+            with metrics.stage('model_load'):
+                model = select_model(model_name)
+                autotuner.apply_threads(autotuner.get_profile(model))
+            with metrics.stage('inference'):
+                result = model.predict(text, truncation=True, max_length=512)
+            response = {'correlation_id': correlation_id, 'result': result, 'model_version': model.version}
+        except Exception as e:
+            response = {'correlation_id': correlation_id, 'error': str(e)}
+        reply_to = task.get('reply_to', 'inference_response')
+
+    elif task_type == 'predict_file':
+        # Инференс для файла: список текстов
+        texts = task.get('texts')
+        model_name = task.get('model_name')  # получаем имя модели из задачи
+        try:
+            metrics.set_gauge('worker_batch_size', len(texts), task_type=task_type)
+            with metrics.stage('model_load'):
+                model = select_model(model_name)
+                tuning = autotuner.get_profile(model)
+                autotuner.apply_threads(tuning)
+            with metrics.stage('inference'):
+                results = model.predict_bulk(texts, batch_size=tuning['batch_size'])
+            response = {'correlation_id': correlation_id, 'results': results, 'model_version': model.version}
+        except Exception as e:
+            response = {'correlation_id': correlation_id, 'error': str(e)}
+        reply_to = task.get('reply_to', 'inference_response')
+
+    elif task_type == 'predict_text_ensemble':
+        # Обработка одиночного предсказания ансамблевой модели
+        text = task.get('text')
+        try:
+            with metrics.stage('model_load'):
+                model = load_ensemble_model()
+            with metrics.stage('inference'):
+                result = model.predict(text)
+            # Оборачиваем результат в словарь с ключом "label"
+            response = {'correlation_id': correlation_id, 'result': {'label': result},
+                        'model_version': model.version}
+        except Exception as e:
+            response = {'correlation_id': correlation_id, 'error': str(e)}
+        reply_to = task.get('reply_to', 'inference_response')
+
+    elif task_type == 'predict_file_ensemble':
+        # Обработка пакетного предсказания ансамблевой модели
+        texts = task.get('texts')
+        try:
+            metrics.set_gauge('worker_batch_size', len(texts), task_type=task_type)
+            with metrics.stage('model_load'):
+                model = load_ensemble_model()
+            with metrics.stage('inference'):
+                results = model.predict_batch(texts)
+            # Формируем список словарей для единообразия
+            response = {'correlation_id': correlation_id, 'results': [{'label': r} for r in results],
+                        'model_version': model.version}
+        except Exception as e:
+            response = {'correlation_id': correlation_id, 'error': str(e)}
+        reply_to = task.get('reply_to', 'inference_response')
+
+    elif task_type == 'predict_batch':
+        # Часть потока записей /api/predict_batch: метки и вероятности всех классов без Excel
+        texts = task.get('texts')
+        try:
+            metrics.set_gauge('worker_batch_size', len(texts), task_type=task_type)
+            if task.get('ensemble'):
+                with metrics.stage('model_load'):
+                    model = load_ensemble_model()
+                with metrics.stage('inference'):
+                    labels, scores = model.predict_batch_scores(texts)
+            else:
+                with metrics.stage('model_load'):
+                    model = select_model(task.get('model_name'))
+                    tuning = autotuner.get_profile(model)
+                    autotuner.apply_threads(tuning)
+                with metrics.stage('inference'):
+                    probs = model.predict_proba(texts, batch_size=tuning['batch_size'])
+                    labels = model.bulk_engine.labels(probs).tolist()
+                    scores = [dict(zip(model.bulk_engine.label_names.tolist(), row)) for row in probs.tolist()]
+            response = {'correlation_id': correlation_id, 'labels': labels, 'scores': scores,
+                        'model_version': model.version}
+        except Exception as e:
+            response = {'correlation_id': correlation_id, 'error': str(e)}
+        reply_to = task.get('reply_to', 'inference_response')
+
+    elif task_type == 'predict_file_fanout':
+        # Один список текстов – несколько моделей (и, по желанию, ансамбль) с общей токенизацией
+        texts = task.get('texts')
+        model_names = list(dict.fromkeys(task.get('model_names') or [None]))
+        try:
+            metrics.set_gauge('worker_batch_size', len(texts), task_type=task_type)
+            with metrics.stage('model_load'):
+                models = {}
+                for name in model_names:
+                    model = select_model(name)
+                    autotuner.get_profile(model)
+                    models[name or 'default'] = model
+                ensemble = load_ensemble_model() if task.get('include_ensemble') else None
+            with metrics.stage('inference'):
+                fanout = run_fanout(texts, models, ensemble)
+            fanout['model_versions'] = {name: model.version for name, model in models.items()}
+            if ensemble is not None:
+                fanout['model_versions']['ensemble'] = ensemble.version
+            response = {'correlation_id': correlation_id, **fanout}
+        except Exception as e:
+            response = {'correlation_id': correlation_id, 'error': str(e)}
+        reply_to = task.get('reply_to', 'inference_response')
+
+    else:
+        response = {'correlation_id': correlation_id, 'error': 'Unknown task type'}
+        reply_to = task.get('reply_to', 'unknown_response')
+
+    return response, reply_to
+
+
+def retrain_loop(records_queue):
+    """
+    Фоновое переобучение классической части ансамбля: размеченные строки задач
+    'prepare_dataset' обрабатываются по очереди в отдельном потоке, чтобы долгий
+    расчёт предсказаний трансформера для нового датасета не задерживал инференс.
+    """
+    # Тренер создаётся при первой необходимости: он держит состояние и трансформер для мета-признаков
+    classic_trainer = None
+    while True:
+        records = records_queue.get()
+        try:
+            if classic_trainer is None:
+                classic_trainer = IncrementalClassicTrainer()
+            version = classic_trainer.update(records)
+            if version:
+                print(f"Классическая часть ансамбля переобучена, опубликована версия {version}")
+        except Exception as e:
+            print(f"Ошибка инкрементального переобучения: {e}")
+
+
+def task_model_label(task):
+    """Метка модели для метрик: имя модели задачи (если модель доступна), 'ensemble' или 'default'."""
+    if (task.get('type') or '').endswith('_ensemble') or task.get('ensemble'):
+        return 'ensemble'
+    return model_label(task.get('model_name'))
+
+
+def start_worker(transport=None):
     """
     Запускает воркера, который слушает топики 'dataset_preparation' и 'inference_request'.
     В зависимости от типа задачи (поле 'type') выполняется обработка:
       - 'prepare_dataset': обрабатывает задачу подготовки датасета,
       - 'predict_text': выполняет инференс для одиночного текста,
-      - 'predict_file': выполняет инференс для списка текстов (из файла).
+      - 'predict_file': выполняет инференс для списка текстов (из файла),
+      - 'predict_file_fanout': выполняет инференс списка текстов несколькими моделями сразу,
+      - 'predict_batch': возвращает метки и вероятности классов для части потока записей.
     Результат отправляется в reply-топик (по умолчанию 'dataset_response' для датасета,
     'inference_response' для инференса) с тем же 'correlation_id'.
+    Задачи проходят через TaskScheduler: интерактивные обслуживаются раньше пакетных,
+    а задачи с истёкшим дедлайном отбрасываются без инференса и без ответа
+    (HTTP-сторона к этому моменту уже вернула таймаут).
+    Времена этапов обработки возвращаются в ответе в поле 'timings'.
+    Задачи с флагом 'profile' (если профилирование включено в конфиге) выполняются
+    под профилировщиком, сводка профиля возвращается в поле 'profile'.
+    Перед приёмом задач автотюнер подбирает размер пакета и число потоков для модели
+    по умолчанию (или берёт сохранённый профиль для этого типа узла); остальные модели
+    подбираются, когда очередь задач пуста.
+    После ответа на 'prepare_dataset' размеченные строки передаются инкрементальному
+    тренеру классической части ансамбля в фоновом потоке (если включён Config.CLASSIC_AUTO_RETRAIN).
+
+    :param transport: Транспорт, общий с сервером (нужен для бэкендов 'local' и 'memory').
+        По умолчанию берётся транспорт из Config.TRANSPORT_BACKEND.
     """
-    consumer = KafkaConsumer(
-        'dataset_preparation', 'inference_request',
-        bootstrap_servers=Config.KAFKA_BROKER_URL,
-        value_deserializer=lambda m: json.loads(m.decode('utf-8')),
-        auto_offset_reset='earliest'
-    )
-    producer = KafkaProducer(
-        bootstrap_servers=Config.KAFKA_BROKER_URL,
-        value_serializer=lambda v: json.dumps(v).encode('utf-8')
+    if transport is not None:
+        set_transport(transport)
+    transport = get_transport()
+
+    # Переобучение идёт в фоновом потоке, воркер только передаёт ему строки
+    retrain_queue = queue.Queue()
+    if Config.CLASSIC_AUTO_RETRAIN:
+        threading.Thread(target=retrain_loop, args=(retrain_queue,), name='classic-retrain', daemon=True).start()
+
+    # Подбор размера пакета и числа потоков для модели по умолчанию – до приёма задач
+    # (профиль сохраняется и при следующих запусках на таком же узле берётся из файла)
+    if Config.AUTOTUNE_ENABLED:
+        try:
+            autotuner.get_profile(select_model(), wait=True)
+        except Exception as e:
+            print(f"Ошибка подбора параметров инференса: {e}")
+
+    # Подбор параметров для остальных моделей (и переподбор устаревших профилей) идёт только
+    # в простое воркера, чтобы замеры не конкурировали с инференсом
+    scheduler = TaskScheduler(
+        transport.consume(['dataset_preparation', 'inference_request']),
+        on_idle=lambda: autotuner.tune_pending(interrupt=scheduler.has_tasks)
     )
 
-    for message in consumer:
-        task = message.value
-        correlation_id = task.get('correlation_id')
+    for task in scheduler:
+        started_at = time.time()
         task_type = task.get('type')
+        for lane, depth in scheduler.depth().items():
+            metrics.set_gauge('worker_queue_depth', depth, lane=lane)
 
-        if task_type == 'prepare_dataset':
-            processed_data = task.get('data')
-            response = {
-                'correlation_id': correlation_id,
-                'processed_data': processed_data
-            }
-            reply_to = task.get('reply_to', 'dataset_response')
-
-        elif task_type == 'predict_text':
-            # Инференс для одиночного текста
-            text = task.get('text')
-            model_name = task.get('model_name')  # получаем имя модели из задачи
-            try:
-                model = select_model(model_name)
-                result = model.predict(text, truncation=True, max_length=512)
-                response = {'correlation_id': correlation_id, 'result': result}
-            except Exception as e:
-                response = {'correlation_id': correlation_id, 'error': str(e)}
-            reply_to = task.get('reply_to', 'inference_response')
-
-        elif task_type == 'predict_file':
-            # Инференс для файла: список текстов
-            texts = task.get('texts')
-            model_name = task.get('model_name')  # получаем имя модели из задачи
-            try:
-                model = select_model(model_name)
-                results = model.predict_batch(texts, batch_size=16, truncation=True, max_length=512)
-                response = {'correlation_id': correlation_id, 'results': results}
-            except Exception as e:
-                response = {'correlation_id': correlation_id, 'error': str(e)}
-            reply_to = task.get('reply_to', 'inference_response')
-        elif task_type == 'predict_text_ensemble':
-            # Обработка одиночного предсказания ансамблевой модели
-            text = task.get('text')
-            try:
-                model = EnsembleSentimentModel()
-                model.load_cached_models()  # подгружаем логистическую и мета-модель из кеша
-                result = model.predict(text)
-                # Оборачиваем результат в словарь с ключом "label"
-                response = {'correlation_id': correlation_id, 'result': {'label': result}}
-            except Exception as e:
-                response = {'correlation_id': correlation_id, 'error': str(e)}
-            reply_to = task.get('reply_to', 'inference_response')
-
-        elif task_type == 'predict_file_ensemble':
-            # Обработка пакетного предсказания ансамблевой модели
-            texts = task.get('texts')
-            try:
-                model = EnsembleSentimentModel()
-                model.load_cached_models()
-                results = model.predict_batch(texts)
-                # Формируем список словарей для единообразия
-                response = {'correlation_id': correlation_id, 'results': [{'label': r} for r in results]}
-            except Exception as e:
-                response = {'correlation_id': correlation_id, 'error': str(e)}
-            reply_to = task.get('reply_to', 'inference_response')
+        timings = metrics.StageTimings(task_type=task_type, model=task_model_label(task))
+        with metrics.activate(timings):
+            if profiling.should_profile(task):
+                (response, reply_to), profile = profiling.run_profiled(handle_task, task, timings)
+                response['profile'] = profile
+            else:
+                response, reply_to = handle_task(task)
+        response['timings'] = timings.as_dict()
+
+        # Время обработки задачи воркером и глубина его очереди – по ним сервер оценивает
+        # ожидание при контроле допуска
+        response['worker_time'] = time.time() - started_at
+        response['queue_depth'] = scheduler.depth()
+
+        # Пока шёл инференс, дедлайн мог истечь – такой ответ, скорее всего, уже никто не ждёт
+        if is_expired(task):
+            metrics.inc('worker_tasks_late_total', type=task_type, lane=task_lane(task))
         else:
-            response = {'correlation_id': correlation_id, 'error': 'Unknown task type'}
-            reply_to = task.get('reply_to', 'unknown_response')
+            metrics.inc('worker_tasks_completed_total', type=task_type, lane=task_lane(task))
+        metrics.flush('worker')
 
         # Отправляем ответ в соответствующий reply-топик
-        producer.send(reply_to, response)
-        producer.flush()
+        wire_format, compression = reply_options(task)
+        transport.reply(reply_to, response, wire_format=wire_format, compression=compression)
+
+        # Переобучение выполняется уже после ответа, чтобы не задерживать HTTP-запрос
+        retrain_records = response.get('processed_data') if task_type == 'prepare_dataset' else None
+        if Config.CLASSIC_AUTO_RETRAIN and retrain_records:
+            retrain_queue.put(retrain_records)
@@ -0,0 +1,89 @@
+import os
+import random
+
+import torch
+from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+# Метки в том же виде, что у модели по умолчанию (blanchefort/rubert-base-cased-sentiment-rusentiment)
+ID2LABEL = {0: "NEUTRAL", 1: "POSITIVE", 2: "NEGATIVE"}
+
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+ALPHABET = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+SYLLABLES = ["ка", "ро", "ни", "ст", "ва", "ли", "ме", "то", "пр", "ен", "ск", "ов", "ая", "ый", "ть", "на"]
+
+# Распределения длины текстов (в словах): от коротких отзывов до длинных сообщений,
+# которые обрезаются до 512 токенов
+TEXT_LENGTHS = {
+    'short': (5, 20),
+    'medium': (40, 120),
+    'long': (300, 600),
+}
+
+
+def make_words(count, seed):
+    """Детерминированный словарь псевдорусских слов из 2-4 слогов."""
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_texts(count, length, words, seed):
+    """
+    Генерирует count текстов с длиной из распределения TEXT_LENGTHS[length].
+    Часть слов заменяется числами и знаками препинания, чтобы препроцессору было что чистить.
+    """
+    rng = random.Random(f"{seed}-{length}")
+    low, high = TEXT_LENGTHS[length]
+    texts = []
+    for _ in range(count):
+        tokens = []
+        for _ in range(rng.randint(low, high)):
+            roll = rng.random()
+            if roll < 0.05:
+                tokens.append(str(rng.randint(1, 2024)))
+            elif roll < 0.1:
+                tokens.append(rng.choice(words).capitalize() + rng.choice([",", ".", "!", "?"]))
+            else:
+                tokens.append(rng.choice(words))
+        texts.append(" ".join(tokens))
+    return texts
+
+
+def make_records(texts, seed):
+    """Размеченные строки датасета в формате prepare_dataset для обучения классической части."""
+    rng = random.Random(seed)
+    return [{'TextAnalyze': text, 'Sentiment': rng.choice("BGN")} for text in texts]
+
+
+def build_tiny_model(path, words, seed, hidden_size=64, num_layers=2):
+    """
+    Сохраняет в path маленькую случайно инициализированную BERT-модель классификации
+    на 3 класса и токенизатор к ней. Модель загружается так же, как скачанные
+    (SentimentModel(model_path=path)), и не требует доступа к сети.
+    """
+    os.makedirs(path, exist_ok=True)
+    vocab = SPECIAL_TOKENS + list(ALPHABET) + ["##" + letter for letter in ALPHABET] + \
+        list("0123456789.,!?") + ["##" + digit for digit in "0123456789"] + SYLLABLES + words
+    vocab_path = os.path.join(path, "vocab.txt")
+    with open(vocab_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(dict.fromkeys(vocab)) + "\n")
+
+    tokenizer = BertTokenizerFast(vocab_file=vocab_path, do_lower_case=True, model_max_length=512)
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(seed)
+    config = BertConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        num_hidden_layers=num_layers,
+        num_attention_heads=max(1, hidden_size // 32),
+        intermediate_size=hidden_size * 4,
+        max_position_embeddings=512,
+        num_labels=len(ID2LABEL),
+        id2label=ID2LABEL,
+        label2id={label: index for index, label in ID2LABEL.items()},
+    )
+    BertForSequenceClassification(config).save_pretrained(path)
+    return path
@@ -0,0 +1,400 @@
+"""
+Офлайн-бенчмарк моделей и пути запроса.
+
+Измеряет пропускную способность и задержки (p50/p95/p99) для:
+  - SentimentModel.predict / predict_batch / predict_bulk при разных размерах пакета, числе потоков и длине текстов;
+  - EnsembleSentimentModel: поштучно и пакетом;
+  - EnsembleSentimentModel.custom_preprocessor;
+  - полного HTTP-пути (Flask и ASGI) с InMemoryTransport вместо Kafka.
+
+Используется маленькая случайно инициализированная BERT-модель, которая создаётся локально,
+поэтому бенчмарк работает без сети. Результаты сохраняются в JSON и могут сравниваться
+с сохранённым базовым прогоном.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run --quick
+    python -m benchmarks.run --save-baseline
+    python -m benchmarks.run --baseline benchmarks/baseline.json --tolerance 0.15
+
+Без --baseline результаты сравниваются с benchmarks/baseline.json, если он сохранён.
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import torch
+import transformers
+
+from app.config import Config
+from app.services.prediction_store import get_store
+from benchmarks.fixtures import TEXT_LENGTHS, build_tiny_model, make_records, make_texts, make_words
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(BENCHMARKS_DIR, 'results', 'latest.json')
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+GROUPS = ('sentiment', 'ensemble', 'preprocess', 'http')
+
+
+def case_name(group, params):
+    return f"{group}[{','.join(f'{key}={value}' for key, value in params.items())}]"
+
+
+def summarize(latencies, items_per_call, elapsed):
+    """Сводка по замерам: задержки одного вызова (секунды) и пропускная способность (текстов в секунду)."""
+    latencies = np.array(latencies)
+    return {
+        'calls': len(latencies),
+        'items': items_per_call * len(latencies),
+        'latency_mean': float(latencies.mean()),
+        'latency_p50': float(np.percentile(latencies, 50)),
+        'latency_p95': float(np.percentile(latencies, 95)),
+        'latency_p99': float(np.percentile(latencies, 99)),
+        'throughput': items_per_call * len(latencies) / elapsed,
+    }
+
+
+@contextlib.contextmanager
+def torch_threads(count):
+    previous = torch.get_num_threads()
+    torch.set_num_threads(count)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
+class Benchmark:
+    """Прогоняет случаи и накапливает результаты {имя случая: сводка}."""
+
+    def __init__(self, iterations, warmup):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.results = {}
+
+    def run(self, group, params, call, items=1, iterations=None, concurrency=1):
+        """
+        Замеряет call: сначала warmup прогревочных вызовов, затем iterations замеров.
+        При concurrency > 1 вызовы выполняются одновременно из нескольких потоков.
+        :param items: Сколько текстов обрабатывает один вызов.
+        """
+        iterations = iterations or self.iterations
+        for _ in range(self.warmup):
+            call()
+
+        latencies = []
+        latencies_lock = threading.Lock()
+
+        def timed_call(_=None):
+            started_at = time.perf_counter()
+            call()
+            elapsed = time.perf_counter() - started_at
+            with latencies_lock:
+                latencies.append(elapsed)
+
+        started_at = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(timed_call, range(iterations)))
+        else:
+            for _ in range(iterations):
+                timed_call()
+        summary = summarize(latencies, items, time.perf_counter() - started_at)
+
+        name = case_name(group, params)
+        self.results[name] = {'group': group, 'params': params, **summary}
+        print(f"{name:<70} p50={summary['latency_p50'] * 1000:9.2f} ms  "
+              f"p95={summary['latency_p95'] * 1000:9.2f} ms  "
+              f"p99={summary['latency_p99'] * 1000:9.2f} ms  {summary['throughput']:9.1f} текст/с")
+        return summary
+
+
+def bench_sentiment(bench, model_dir, corpora, batch_sizes, thread_counts, batch_items):
+    from app.models.sentiment_model import SentimentModel
+
+    model = SentimentModel(model_path=model_dir)
+    for length, texts in corpora.items():
+        workload = texts[:batch_items]
+        for threads in thread_counts:
+            with torch_threads(threads):
+                single = itertools.cycle(texts)
+                bench.run('sentiment.predict', {'length': length, 'threads': threads},
+                          lambda: model.predict(next(single), truncation=True, max_length=512),
+                          iterations=bench.iterations * 10)
+                for batch_size in batch_sizes:
+                    bench.run('sentiment.predict_batch',
+                              {'length': length, 'threads': threads, 'batch_size': batch_size},
+                              lambda: model.predict_batch(workload, batch_size=batch_size,
+                                                          truncation=True, max_length=512),
+                              items=len(workload))
+                    bench.run('sentiment.predict_bulk',
+                              {'length': length, 'threads': threads, 'batch_size': batch_size},
+                              lambda: model.predict_bulk(workload, batch_size=batch_size),
+                              items=len(workload))
+
+
+def quiet(call):
+    """Подавляет вывод call: get_meta_features печатает предсказания для каждого текста."""
+    def wrapper():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            return call()
+    return wrapper
+
+
+def prepare_ensemble(model_dir, workdir, texts, seed):
+    """Обучает классическую часть на синтетической разметке и загружает ансамбль с ней."""
+    from app.models.ensemble_sentiment_model import EnsembleSentimentModel
+    from app.services.classic_trainer import IncrementalClassicTrainer
+
+    Config.CLASSIC_ARTIFACTS_DIR = os.path.join(workdir, 'classic')
+    model = EnsembleSentimentModel(transformer_model_name=model_dir, device=-1)
+    if not os.path.exists(os.path.join(Config.CLASSIC_ARTIFACTS_DIR, 'LATEST')):
+        trainer = IncrementalClassicTrainer(
+            transformer_predict_batch=model.get_transformer_preds,
+            artifacts_dir=Config.CLASSIC_ARTIFACTS_DIR,
+            state_path=os.path.join(workdir, 'classic_trainer_state.pkl'),
+        )
+        trainer.update(make_records(texts, seed))
+    model.load_cached_models()
+    return model
+
+
+def bench_ensemble(bench, model, corpora, batch_items):
+    for length, texts in corpora.items():
+        workload = texts[:batch_items]
+        single = itertools.cycle(texts)
+        bench.run('ensemble.predict', {'length': length},
+                  quiet(lambda: model.predict(next(single))), iterations=bench.iterations * 10)
+        bench.run('ensemble.predict_per_text', {'length': length},
+                  quiet(lambda: [model.predict(text) for text in workload]), items=len(workload))
+        bench.run('ensemble.predict_batch', {'length': length},
+                  quiet(lambda: model.predict_batch(workload)), items=len(workload))
+
+
+def bench_preprocess(bench, corpora, batch_items):
+    from app.models.ensemble_sentiment_model import EnsembleSentimentModel
+
+    for length, texts in corpora.items():
+        workload = texts[:batch_items]
+        bench.run('preprocess.custom_preprocessor', {'length': length},
+                  lambda: [EnsembleSentimentModel.custom_preprocessor(text) for text in workload],
+                  items=len(workload))
+
+
+def excel_payload(texts):
+    output = BytesIO()
+    pd.DataFrame({'MessageText': texts}).to_excel(output, index=False)
+    return output.getvalue()
+
+
+def _checked(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+    return response
+
+
+def bench_http(bench, model_dir, corpora, batch_items, concurrency_levels):
+    """
+    Полный путь запроса: HTTP-обработчик -> транспорт (в памяти, с кодеком) -> воркер в потоке -> ответ.
+    Воркер обрабатывает задачи так же, как в рабочем режиме, включая загрузку модели на задачу.
+    """
+    from app import create_app
+    from app.services.transport import InMemoryTransport, set_transport
+    from app.worker import start_worker
+
+    Config.TRANSPORT_BACKEND = 'memory'
+    Config.DEFAULT_MODEL_NAME = model_dir
+    Config.ENSEMBLE_TRANSFORMER_MODEL = model_dir
+    transport = InMemoryTransport()
+    set_transport(transport)
+    worker = threading.Thread(target=start_worker, args=(transport,), daemon=True)
+    worker.start()
+
+    texts = corpora.get('short') or next(iter(corpora.values()))
+    single = itertools.cycle(texts)
+    file_payload = excel_payload(texts[:batch_items])
+
+    servers = [('dev', create_app().test_client())]
+    try:
+        from starlette.testclient import TestClient
+        from app.asgi import create_asgi_app
+        servers.append(('async', TestClient(create_asgi_app())))
+    except ImportError as e:
+        print(f"Асинхронный сервер пропущен: {e}")
+
+    try:
+        for server, client in servers:
+            with client if server == 'async' else contextlib.nullcontext():
+                def post_file(url):
+                    if server == 'async':
+                        return client.post(url, files={'file': ('data.xlsx', file_payload)})
+                    return client.post(url, data={'file': (BytesIO(file_payload), 'data.xlsx')},
+                                       content_type='multipart/form-data')
+
+                for concurrency in concurrency_levels:
+                    bench.run('http.predict_text', {'server': server, 'concurrency': concurrency},
+                              lambda: _checked(client.post('/api/predict_text', json={'text': next(single)})),
+                              iterations=bench.iterations * 5, concurrency=concurrency)
+                bench.run('http.predict_text_ensemble', {'server': server},
+                          quiet(lambda: _checked(client.post('/api/predict_text_ensemble',
+                                                             json={'text': next(single)}))),
+                          iterations=bench.iterations * 5)
+                bench.run('http.predict_file', {'server': server, 'rows': batch_items},
+                          lambda: _checked(post_file('/api/predict_file')), items=batch_items)
+                bench.run('http.predict_file_ensemble', {'server': server, 'rows': batch_items},
+                          quiet(lambda: _checked(post_file('/api/predict_file_ensemble'))), items=batch_items)
+    finally:
+        transport.close()
+        worker.join(timeout=10)
+
+
+def environment_info(args):
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'torch': torch.__version__,
+        'transformers': transformers.__version__,
+        'seed': args.seed,
+        'quick': args.quick,
+        'model': {'hidden_size': args.hidden_size, 'num_layers': args.num_layers},
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Сравнивает результаты с базовым прогоном. Регрессия – p95 задержки выросла
+    или пропускная способность упала больше, чем на tolerance (доля).
+    Случаи, которых нет в базовом прогоне, не сравниваются.
+    :return: Список описаний регрессий.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        if current['latency_p95'] > previous['latency_p95'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['latency_p95'] * 1000:.2f} -> "
+                               f"{current['latency_p95'] * 1000:.2f} ms")
+        if current['throughput'] < previous['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: пропускная способность {previous['throughput']:.1f} -> "
+                               f"{current['throughput']:.1f} текст/с")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк моделей и пути запроса")
+    parser.add_argument('--quick', action='store_true', help="Сокращённая сетка параметров")
+    parser.add_argument('--only', default=','.join(GROUPS), help=f"Группы через запятую: {', '.join(GROUPS)}")
+    parser.add_argument('--iterations', type=int, default=None, help="Замеров на пакетный случай")
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--hidden-size', type=int, default=64)
+    parser.add_argument('--num-layers', type=int, default=2)
+    parser.add_argument('--workdir', default=None,
+                        help="Папка для модели и артефактов (по умолчанию временная, удаляется после прогона)")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--baseline', default=None,
+                        help=f"JSON базового прогона для сравнения (по умолчанию {DEFAULT_BASELINE}, если он есть)")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Допустимое ухудшение (доля)")
+    parser.add_argument('--save-baseline', action='store_true', help=f"Сохранить результаты в {DEFAULT_BASELINE}")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    groups = [group.strip() for group in args.only.split(',') if group.strip()]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        raise SystemExit(f"Неизвестные группы: {sorted(unknown)}")
+    # Базовый прогон читается до замеров: --save-baseline перезапишет его результатами этого прогона
+    baseline_path = args.baseline or (DEFAULT_BASELINE if os.path.exists(DEFAULT_BASELINE) else None)
+    baseline = None
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    # Ансамбль воркер создаёт на каждую задачу, модели – при первом использовании и при подборе
+    # параметров: индикаторы загрузки весов засоряют отчёт
+    transformers.logging.disable_progress_bar()
+    transformers.logging.set_verbosity_error()
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    if args.quick:
+        batch_sizes, lengths, batch_items, iterations = [1, 16], ['short', 'long'], 32, 3
+        thread_counts = sorted({1, os.cpu_count() or 1})
+        concurrency_levels = [1, 4]
+    else:
+        batch_sizes, lengths, batch_items, iterations = [1, 8, 16, 32, 64], list(TEXT_LENGTHS), 64, 10
+        thread_counts = sorted({n for n in (1, 2, 4, 8, os.cpu_count() or 1) if n <= (os.cpu_count() or 1)})
+        concurrency_levels = [1, 4, 16]
+    bench = Benchmark(args.iterations or iterations, args.warmup)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='sentiment-bench-')
+    # Метрики, артефакты и синтетические предсказания бенчмарка не должны смешиваться с рабочими
+    Config.METRICS_DIR = os.path.join(workdir, 'metrics')
+    Config.PREDICTION_STORE_PATH = os.path.join(workdir, 'predictions.sqlite3')
+    Config.MODEL_CACHE_DIR = os.path.join(workdir, 'models')
+    Config.AUTOTUNE_PROFILES_PATH = os.path.join(workdir, 'autotune.json')
+    try:
+        words = make_words(2000, args.seed)
+        model_dir = os.path.join(workdir, 'tiny-bert')
+        if not os.path.exists(os.path.join(model_dir, 'config.json')):
+            build_tiny_model(model_dir, words, args.seed, args.hidden_size, args.num_layers)
+        corpora = {length: make_texts(max(batch_items, 200), length, words, args.seed) for length in lengths}
+
+        if 'sentiment' in groups:
+            bench_sentiment(bench, model_dir, corpora, batch_sizes, thread_counts, batch_items)
+        if 'ensemble' in groups or 'http' in groups:
+            ensemble = prepare_ensemble(model_dir, workdir, make_texts(500, 'medium', words, args.seed + 1), args.seed)
+            if 'ensemble' in groups:
+                bench_ensemble(bench, ensemble, corpora, batch_items)
+        if 'preprocess' in groups:
+            bench_preprocess(bench, corpora, batch_items)
+        if 'http' in groups:
+            bench_http(bench, model_dir, corpora, batch_items, concurrency_levels)
+            get_store().close()
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'meta': environment_info(args), 'results': bench.results}
+    for path in [args.output] + ([DEFAULT_BASELINE] if args.save_baseline else []):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {path}")
+
+    if baseline is not None:
+        print(f"Сравнение с базовым прогоном {baseline_path}")
+        base_meta = baseline.get('meta', {})
+        if (base_meta.get('cpu_count'), base_meta.get('machine')) != (os.cpu_count(), platform.machine()):
+            print("Внимание: базовый прогон получен на другой машине, сравнение может быть неточным")
+        regressions = compare(bench.results, baseline, args.tolerance)
+        if regressions:
+            print(f"Регрессии (допуск {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("Регрессий относительно базового прогона нет")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
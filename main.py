@@ -1,6 +1,8 @@
 import multiprocessing
 from app import create_app
+from app.config import Config
 from app.worker import start_worker
+from app.services.transport import get_transport
 from flask_cors import CORS
 
 
@@ -8,16 +10,41 @@ def run_flask():
     app = create_app()
     CORS(app)
     # Указываем host="0.0.0.0", чтобы сервер слушал все интерфейсы, и был доступен извне контейнера.
-    app.run(host='0.0.0.0', port=8000, debug=True, threaded=True)
+    # Перезагрузчик перезапускает процесс, поэтому с локальным транспортом (общие очереди) он отключён.
+    app.run(host='0.0.0.0', port=8000, debug=True, threaded=True,
+            use_reloader=Config.TRANSPORT_BACKEND == 'kafka')
+
+
+def run_async_server():
+    """
+    Продакшн-режим: uvicorn с асинхронными эндпоинтами инференса.
+    С транспортом Kafka запускается Config.SERVER_WORKERS процессов на одном порту;
+    локальные очереди общие только для процессов, созданных fork'ом, поэтому
+    с остальными транспортами сервер работает в одном процессе.
+    """
+    import uvicorn
+    from app.asgi import create_asgi_app
+
+    if Config.TRANSPORT_BACKEND == 'kafka' and Config.SERVER_WORKERS > 1:
+        uvicorn.run('app.asgi:create_asgi_app', factory=True, host='0.0.0.0', port=8000,
+                    workers=Config.SERVER_WORKERS, log_level='warning')
+    else:
+        uvicorn.run(create_asgi_app(), host='0.0.0.0', port=8000, log_level='warning')
 
 
 if __name__ == '__main__':
+    # Транспорт создаётся до запуска воркера, чтобы локальные очереди были общими для обоих процессов
+    transport = get_transport()
+
     # Запускаем воркер в отдельном процессе
-    worker_process = multiprocessing.Process(target=start_worker)
+    worker_process = multiprocessing.Process(target=start_worker, args=(transport,))
     worker_process.start()
 
-    # Запускаем Flask-сервер
-    run_flask()
+    # Запускаем HTTP-сервер
+    if Config.SERVER_MODE == 'async':
+        run_async_server()
+    else:
+        run_flask()
 
-    # Когда Flask-сервер завершится, завершаем воркер
+    # Когда сервер завершится, завершаем воркер
     worker_process.join()